@@ -41,7 +41,6 @@
 import sys
 import tempfile
 import shutil
-import atexit
 from glob import glob
 import socket
 import signal
@@ -320,6 +319,87 @@ def alarm_handler(signum, frame):
     raise OSError("Timeout exceeded!")
 
 
+def grid_minute(args, output_dir):
+    """Grid the minute of GLM data in args.filenames and move the results to output_dir.
+
+    Returns the paths of the output files. Everything is produced in a
+    temporary directory that is removed before returning.
+    """
+    # set up temporary dir
+    tempdir_path = tempfile.mkdtemp(suffix=None, prefix="tmp-glm-grids-", dir=os.getcwd())
+    log.info("working in: {}".format(tempdir_path))
+    try:
+        # do the gridding
+        gridder, glm_filenames, start_time, end_time, grid_kwargs = grid_setup(args, work_dir=tempdir_path)
+        gridder_return = gridder(glm_filenames, start_time, end_time, **grid_kwargs)
+
+        gridded_files = []
+        for subgrid in gridder_return:
+            for gridded_file in subgrid[1]:
+                gridded_files.append(gridded_file)
+
+        # we need to add attributes here due to an issue where satpy (or its dependencies) are
+        # holding the input gridded file open until the process exits
+        for f in gridded_files:
+            add_gglm_attrs(f, glm_filenames)
+
+        # (optionally) do tiling
+        if args.create_tiles:
+
+            sector = get_goes_position(glm_filenames)
+            if sector == "east":
+                sector_id = "GOES_EAST"
+            elif sector == "west":
+                sector_id = "GOES_WEST"
+            else:
+                raise RuntimeError("could not determine sector_id")
+
+            from satpy import Scene
+
+            for gridded_file in gridded_files:
+                log.info("TILING: {}".format(gridded_files))
+                scn = Scene(reader='glm_l2', filenames=[gridded_file])  # n.b. satpy requires a list of filenames
+                scn.load([
+                    'DQF',
+                    'flash_extent_density',
+                    'minimum_flash_area',
+                    'total_energy',
+                ])
+
+                scn.save_datasets(writer='awips_tiled',
+                                  template='glm_l2_radf',
+                                  sector_id=sector_id,
+                                  # sector_id becomes an attribute in the output files and may be another legacy kind of thing. I'm not sure how much is is actually used here.
+                                  source_name="",
+                                  # You could probably make source_name an empty string. I think it is required by the writer for legacy reasons but isn't actually used for the glm output
+                                  base_dir=tempdir_path,
+                                  # base_dir is the output directory. I think blank is the same as current directory.
+                                  tile_size=(506, 904),
+                                  # tile_size is set to the size of the GLMF sample tiles we were given and should match the full disk ABI tiles which is what they wanted
+                                  check_categories=False,
+                                  # check_categories is there because of that issue I mentioned where DQF is all valid all the time so there is no way to detect empty tiles unless we ignore the "category" products
+                                  environment_prefix=args.system_environment_prefix_tiles,
+                                  compress=True)
+
+        # pick up output files from the tempdir
+        # output looks like: CG_GLM-L2-GLMC-M3_G17_T03_20200925160040.nc
+        log.debug("files in {}".format(tempdir_path))
+        log.debug(os.listdir(tempdir_path))
+        log.debug("moving output to {}".format(output_dir))
+        tiled_path = os.path.join(tempdir_path,
+                                  '{}_GLM-L2-GLM*-M?_G??_T??_*.nc'.format(args.system_environment_prefix_tiles))
+        tiled_files = glob(tiled_path)
+        outputs = []
+        for f in tiled_files:
+            add_gglm_attrs(f, glm_filenames)
+            outputs.append(shutil.move(f, os.path.join(output_dir, os.path.basename(f))))
+        for f in gridded_files:
+            outputs.append(shutil.move(f, os.path.join(output_dir, os.path.basename(f))))
+        return outputs
+    finally:
+        shutil.rmtree(tempdir_path, ignore_errors=True)
+
+
 if __name__ == '__main__':
     signal.signal(signal.SIGALRM, alarm_handler)
     signal.alarm(10 * 60)  # timeout if we're not done after 10 minutes
@@ -343,76 +423,4 @@ def alarm_handler(signum, frame):
     # set up output dir
     os.makedirs(args.output_dir, exist_ok=True)
 
-    # set up temporary dir
-    tempdir_path = tempfile.mkdtemp(suffix=None, prefix="tmp-glm-grids-", dir=os.getcwd())
-    log.info("working in: {}".format(tempdir_path))
-    # clean our temporary dir on exit
-    atexit.register(shutil.rmtree, tempdir_path)
-
-    # do the gridding
-    gridder, glm_filenames, start_time, end_time, grid_kwargs = grid_setup(args, work_dir=tempdir_path)
-    gridder_return = gridder(glm_filenames, start_time, end_time, **grid_kwargs)
-
-    gridded_files = []
-    for subgrid in gridder_return:
-        for gridded_file in subgrid[1]:
-            gridded_files.append(gridded_file)
-
-    # we need to add attributes here due to an issue where satpy (or its dependencies) are
-    # holding the input gridded file open until the process exits
-    for f in gridded_files:
-        add_gglm_attrs(f, glm_filenames)
-
-    # (optionally) do tiling
-    if args.create_tiles:
-
-        sector = get_goes_position(glm_filenames)
-        if sector == "east":
-            sector_id = "GOES_EAST"
-        elif sector == "west":
-            sector_id = "GOES_WEST"
-        else:
-            raise RuntimeError("could not determine sector_id")
-
-        from satpy import Scene
-
-        for gridded_file in gridded_files:
-            log.info("TILING: {}".format(gridded_files))
-            scn = Scene(reader='glm_l2', filenames=[gridded_file])  # n.b. satpy requires a list of filenames
-            scn.load([
-                'DQF',
-                'flash_extent_density',
-                'minimum_flash_area',
-                'total_energy',
-            ])
-
-            scn.save_datasets(writer='awips_tiled',
-                              template='glm_l2_radf',
-                              sector_id=sector_id,
-                              # sector_id becomes an attribute in the output files and may be another legacy kind of thing. I'm not sure how much is is actually used here.
-                              source_name="",
-                              # You could probably make source_name an empty string. I think it is required by the writer for legacy reasons but isn't actually used for the glm output
-                              base_dir=tempdir_path,
-                              # base_dir is the output directory. I think blank is the same as current directory.
-                              tile_size=(506, 904),
-                              # tile_size is set to the size of the GLMF sample tiles we were given and should match the full disk ABI tiles which is what they wanted
-                              check_categories=False,
-                              # check_categories is there because of that issue I mentioned where DQF is all valid all the time so there is no way to detect empty tiles unless we ignore the "category" products
-                              environment_prefix=args.system_environment_prefix_tiles,
-                              compress=True)
-
-    # pick up output files from the tempdir
-    # output looks like: CG_GLM-L2-GLMC-M3_G17_T03_20200925160040.nc
-    log.debug("files in {}".format(tempdir_path))
-    log.debug(os.listdir(tempdir_path))
-    log.debug("moving output to {}".format(args.output_dir))
-    tiled_path = os.path.join(tempdir_path,
-                              '{}_GLM-L2-GLM*-M?_G??_T??_*.nc'.format(args.system_environment_prefix_tiles))
-    tiled_files = glob(tiled_path)
-    for f in tiled_files:
-        add_gglm_attrs(f, glm_filenames)
-        shutil.move(f, os.path.join(args.output_dir, os.path.basename(f)))
-    for f in gridded_files:
-        shutil.move(f, os.path.join(args.output_dir, os.path.basename(f)))
-
-    # tempdir cleans itself up via atexit, above
+    grid_minute(args, args.output_dir)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+parse_desc = """Grid every complete minute (three 20 s GLM LCFA files) found under a directory.
+
+Minutes are gridded with _minute_gridder.grid_minute on a pool of long-lived
+worker processes, so glmtools/lmatools/satpy are imported once per worker
+instead of once per minute. Completed minutes are appended to a manifest in
+the output directory and skipped when the command is run again.
+
+Example usage:
+
+    %(prog)s --goes-sector full --workers 16 -o grids/ /data/GLM-L2-LCFA/2019
+"""
+
+import os
+import sys
+import signal
+import logging
+import argparse
+import multiprocessing
+from glob import glob
+from collections import defaultdict
+
+from glmtools.io.glm import parse_glm_filename
+
+from _minute_gridder import grid_minute, alarm_handler
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = ".gridded_minutes"
+
+# seconds allowed per minute, set in each worker by init_worker
+task_timeout = None
+
+
+def create_parser():
+    prog = os.getenv('PROG_NAME', sys.argv[0])
+    parser = argparse.ArgumentParser(prog=prog,
+                                     description=parse_desc,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-v', '--verbose', dest='verbosity', action="count", default=0,
+                        help="each occurrence increases verbosity 1 level through ERROR-WARNING-INFO-DEBUG\n"
+                             "(default: ERROR)")
+    parser.add_argument('-l', '--log', dest="log_fn", default=None,
+                        help="specify a log filename.\n"
+                             "(default: print to screen).")
+    parser.add_argument('-o', '--output-dir', metavar='OUTPUT_DIR',
+                        default=os.getcwd(), help="output directory (default: use current directory)")
+    parser.add_argument('--goes-sector', default="full", choices=['full', 'conus', 'meso'],
+                        help="If sector is meso, ctr_lon and ctr_lat \n"
+                             "are interpreted as the ctr_x and ctr_y of the fixed grid.\n"
+                             "(default: full)")
+    parser.add_argument("-t", "--create-tiles", default=False, action='store_true',
+                        help="create AWIPS-compatible tiles (default: off)")
+    parser.add_argument('--ctr-lat', metavar='latitude',
+                        type=float, help='center latitude (required for meso)')
+    parser.add_argument('--ctr-lon', metavar='longitude',
+                        type=float, help='center longitude (required for meso)')
+    parser.add_argument('--system-environment-prefix', default="CG",
+                        help="set the system environment prefix for the output grids (default: CG)")
+    parser.add_argument('--system-environment-prefix-tiles', default="CSPP_OR",
+                        help="set the system environment prefix for the output tiles (default: CSPP_OR)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: one per core)")
+    parser.add_argument('--timeout', type=int, default=10 * 60,
+                        help="seconds allowed to grid a single minute (default: 600)")
+    parser.add_argument('--manifest', default=None,
+                        help="file listing the completed minutes\n"
+                             "(default: {} in the output directory)".format(MANIFEST_FILENAME))
+    parser.add_argument(dest='input_dir', metavar='input_dir',
+                        help="directory searched recursively for OR_GLM-L2-LCFA_*.nc files")
+    return parser
+
+
+def minute_key(filename):
+    """Identify the minute a LCFA file belongs to, e.g. 'G16_s20190010001'."""
+    _, _, platform, start, _, _ = parse_glm_filename(os.path.basename(filename))
+    return "{}_s{}".format(platform, start.strftime("%Y%j%H%M"))
+
+
+def group_minutes(filenames):
+    """Group LCFA files into {minute key: files}, keeping only complete trios."""
+    minutes = defaultdict(list)
+    for f in filenames:
+        try:
+            minutes[minute_key(f)].append(f)
+        except Exception:
+            log.warning("could not parse GLM filename {}".format(f))
+    complete = {}
+    for key, files in sorted(minutes.items()):
+        if len(files) == 3:
+            complete[key] = sorted(files)
+        else:
+            log.warning("skipping {}: found {} of 3 files".format(key, len(files)))
+    return complete
+
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def init_worker(timeout, log_level, log_fn):
+    # workers are forked after the imports above, so glmtools & co. are loaded once per process
+    global task_timeout
+    logging.basicConfig(level=log_level, filename=log_fn)
+    signal.signal(signal.SIGALRM, alarm_handler)
+    # let the parent handle Ctrl-C and shut the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    task_timeout = timeout
+
+
+def grid_task(task):
+    """Grid one minute inside a worker; never raises so the pool keeps running."""
+    key, args, output_dir = task
+    signal.alarm(task_timeout)
+    try:
+        outputs = grid_minute(args, output_dir)
+        return key, True, outputs
+    except BaseException as e:  # grid_setup calls exit() on bad input
+        return key, False, repr(e)
+    finally:
+        signal.alarm(0)
+
+
+if __name__ == '__main__':
+    parser = create_parser()
+    args = parser.parse_args()
+
+    levels = [logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG]
+    log_level = levels[max(min(len(levels) - 1, args.verbosity), 0)]
+    logging.basicConfig(level=log_level, filename=args.log_fn)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, MANIFEST_FILENAME)
+    done = read_manifest(manifest_path)
+
+    filenames = glob(os.path.join(args.input_dir, '**', 'OR_GLM-L2-LCFA_*.nc'), recursive=True)
+    minutes = group_minutes(filenames)
+    pending = [key for key in minutes if key not in done]
+    log.info("{} complete minutes, {} already gridded, {} to do".format(len(minutes), len(minutes) - len(pending), len(pending)))
+
+    minute_args = dict(vars(args), realtime=False)
+    for k in ('workers', 'timeout', 'manifest', 'input_dir'):
+        minute_args.pop(k)
+    tasks = [(key, argparse.Namespace(**minute_args, filenames=minutes[key]), args.output_dir) for key in pending]
+
+    failed = 0
+    with multiprocessing.Pool(args.workers, initializer=init_worker,
+                              initargs=(args.timeout, log_level, args.log_fn)) as pool, \
+            open(manifest_path, 'a') as manifest:
+        for i, (key, ok, result) in enumerate(pool.imap_unordered(grid_task, tasks), 1):
+            if ok:
+                manifest.write(key + "\n")
+                manifest.flush()
+                log.info("[{}/{}] {} -> {}".format(i, len(tasks), key, ", ".join(os.path.basename(f) for f in result)))
+            else:
+                failed += 1
+                log.error("[{}/{}] {} failed: {}".format(i, len(tasks), key, result))
+    if failed:
+        log.error("{} of {} minutes failed".format(failed, len(tasks)))
+        sys.exit(1)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+parse_desc = """Watch a directory for GLM LCFA files and grid each minute as soon as its three files have arrived.
+
+Replaces re-invoking _minute_gridder.py --realtime from cron: arriving files are
+kept in an in-memory index keyed by minute, and a complete trio is handed to a
+pool of warm gridding workers right away. Uses inotify when the inotify_simple
+package is installed and falls back to polling the directory otherwise.
+A minute whose gridding fails keeps its files in the index and is retried
+when the next file arrives, until it expires.
+
+The end-to-end latency of every minute (arrival of its last file -> grid
+written) is logged together with a running summary, and optionally appended
+to a CSV.
+
+Example usage:
+
+    %(prog)s --goes-sector full -o grids/ --latency-log latency.csv /data/GLM-L2-LCFA/incoming
+"""
+
+import os
+import sys
+import time
+import fnmatch
+import logging
+import argparse
+import threading
+import multiprocessing
+from collections import defaultdict
+
+from _minute_gridder_batch import (create_parser as create_batch_parser, minute_key, read_manifest,
+                                   init_worker, grid_task, MANIFEST_FILENAME)
+
+log = logging.getLogger(__name__)
+
+LCFA_PATTERN = 'OR_GLM-L2-LCFA_*.nc'
+
+
+def create_parser():
+    parser = create_batch_parser()
+    parser.description = parse_desc
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                        help="seconds between directory scans when inotify is not available (default: 2)")
+    parser.add_argument('--force-polling', default=False, action='store_true',
+                        help="poll the directory even if inotify is available")
+    parser.add_argument('--expire', type=float, default=15 * 60,
+                        help="seconds after its last file arrived at which an incomplete or failing "
+                             "minute is dropped (default: 900)")
+    parser.add_argument('--latency-log', default=None,
+                        help="CSV file the latency of every gridded minute is appended to")
+    parser.add_argument('--catch-up', default=False, action='store_true',
+                        help="also grid complete minutes already in the directory at startup")
+    return parser
+
+
+class MinuteIndex:
+    """In-memory index of arriving LCFA files, keyed by minute.
+
+    A minute stays in the index until it has been gridded: a failed minute is
+    handed out again by the next `ready` call, until it expires.
+    """
+
+    def __init__(self):
+        self.minutes = defaultdict(dict)  # minute key -> {path: arrival time}
+        self.running = set()              # minutes handed out and not finished yet
+        self.lock = threading.Lock()      # `finish` runs in the pool's result thread
+
+    def add(self, path, arrival):
+        """Record a file; returns its minute key."""
+        try:
+            key = minute_key(path)
+        except Exception:
+            log.warning("could not parse GLM filename {}".format(path))
+            return None
+        with self.lock:
+            self.minutes[key][path] = arrival
+        return key
+
+    def ready(self):
+        """Keys of the complete minutes not being gridded, which are now marked as running."""
+        with self.lock:
+            keys = sorted(k for k, files in self.minutes.items() if len(files) == 3 and k not in self.running)
+            self.running.update(keys)
+        return keys
+
+    def files(self, key):
+        """Files of a minute and the arrival of the last one."""
+        with self.lock:
+            files = dict(self.minutes[key])
+        return sorted(files), max(files.values())
+
+    def finish(self, key, ok):
+        """Forget a gridded minute, or keep the files of a failed one for a retry."""
+        with self.lock:
+            self.running.discard(key)
+            if ok:
+                self.minutes.pop(key, None)
+
+    def expire(self, older_than):
+        with self.lock:
+            for key in [k for k, files in self.minutes.items()
+                        if k not in self.running and max(files.values()) < older_than]:
+                if len(self.minutes[key]) == 3:
+                    log.warning("dropping {}: gridding kept failing".format(key))
+                else:
+                    log.warning("dropping {}: only {} of 3 files arrived".format(key, len(self.minutes[key])))
+                del self.minutes[key]
+
+
+class LatencyStats:
+    """Running summary of the arrival -> grid written latency, optionally logged to CSV."""
+
+    def __init__(self, csv_path=None):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.csv_path = csv_path
+        if csv_path is not None and not os.path.exists(csv_path):
+            with open(csv_path, 'w') as f:
+                f.write("minute,arrival,written,latency_s,ok\n")
+
+    def record(self, key, arrival, written, ok):
+        with self.lock:
+            if ok:
+                self.latencies.append(written - arrival)
+            if self.csv_path is not None:
+                with open(self.csv_path, 'a') as f:
+                    f.write("{},{:.3f},{:.3f},{:.3f},{}\n".format(key, arrival, written, written - arrival, int(ok)))
+
+    def summary(self):
+        with self.lock:
+            if not self.latencies:
+                return "no minutes gridded yet"
+            ordered = sorted(self.latencies)
+            p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+            return "minutes={} mean={:.1f}s p95={:.1f}s max={:.1f}s".format(
+                len(ordered), sum(ordered) / len(ordered), p95, ordered[-1])
+
+
+def scan(directory):
+    """{path: size} of the LCFA files in directory."""
+    found = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and fnmatch.fnmatch(entry.name, LCFA_PATTERN):
+                found[entry.path] = entry.stat().st_size
+    return found
+
+
+def poll_new_files(directory, interval):
+    """Yield (path, arrival time) of new LCFA files by scanning the directory.
+
+    A file is reported once its size is unchanged between two scans, so files
+    still being written are not picked up early. Files present when this is
+    called are not reported.
+    """
+    sizes = scan(directory)
+
+    def watch(sizes):
+        reported = set(sizes)
+        while True:
+            time.sleep(interval)
+            current = scan(directory)
+            now = time.time()
+            for path, size in current.items():
+                if path not in reported and sizes.get(path) == size:
+                    reported.add(path)
+                    yield path, now
+            reported &= set(current)
+            sizes = current
+
+    return watch(sizes)
+
+
+def inotify_new_files(directory):
+    """Yield (path, arrival time) of LCFA files closed after writing or moved into the directory."""
+    from inotify_simple import INotify, flags
+
+    inotify = INotify()
+    inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    def watch():
+        while True:
+            for event in inotify.read():
+                if fnmatch.fnmatch(event.name, LCFA_PATTERN):
+                    yield os.path.join(directory, event.name), time.time()
+
+    return watch()
+
+
+def new_files(args):
+    if not args.force_polling:
+        try:
+            import inotify_simple  # noqa: F401
+            log.info("watching {} with inotify".format(args.input_dir))
+            return inotify_new_files(args.input_dir)
+        except ImportError:
+            log.info("inotify_simple not available, falling back to polling")
+    log.info("polling {} every {}s".format(args.input_dir, args.poll_interval))
+    return poll_new_files(args.input_dir, args.poll_interval)
+
+
+if __name__ == '__main__':
+    parser = create_parser()
+    args = parser.parse_args()
+
+    levels = [logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG]
+    log_level = levels[max(min(len(levels) - 1, args.verbosity), 0)]
+    logging.basicConfig(level=log_level, filename=args.log_fn)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, MANIFEST_FILENAME)
+    done = read_manifest(manifest_path)
+    manifest = open(manifest_path, 'a')
+    manifest_lock = threading.Lock()
+
+    minute_args = dict(vars(args), realtime=False)
+    for k in ('workers', 'timeout', 'manifest', 'input_dir', 'poll_interval', 'force_polling',
+              'expire', 'latency_log', 'catch_up'):
+        minute_args.pop(k)
+
+    index = MinuteIndex()
+    stats = LatencyStats(args.latency_log)
+    pool = multiprocessing.Pool(args.workers, initializer=init_worker,
+                                initargs=(args.timeout, log_level, args.log_fn))
+
+    def submit(key):
+        files, arrival = index.files(key)
+        if key in done:
+            index.finish(key, True)
+            return
+        done.add(key)
+
+        def on_done(result):
+            _, ok, outputs = result
+            stats.record(key, arrival, time.time(), ok)
+            index.finish(key, ok)
+            if ok:
+                with manifest_lock:
+                    manifest.write(key + "\n")
+                    manifest.flush()
+                log.info("{} -> {} ({})".format(key, ", ".join(os.path.basename(f) for f in outputs), stats.summary()))
+            else:
+                done.discard(key)
+                log.error("{} failed, retrying on the next file: {}".format(key, outputs))
+
+        task = (key, argparse.Namespace(**minute_args, filenames=files), args.output_dir)
+        pool.apply_async(grid_task, (task,), callback=on_done)
+
+    # start watching before the catch-up scan so no file falls in between
+    watcher = new_files(args)
+    if args.catch_up:
+        for path in sorted(scan(args.input_dir)):
+            index.add(path, time.time())
+        for key in index.ready():
+            submit(key)
+
+    try:
+        for path, arrival in watcher:
+            index.add(path, arrival)
+            index.expire(time.time() - args.expire)
+            # complete minutes, including failed ones that are retried
+            for key in index.ready():
+                submit(key)
+    except KeyboardInterrupt:
+        log.info("stopping: {}".format(stats.summary()))
+    finally:
+        pool.close()
+        pool.join()
+        manifest.close()
+    sys.exit(0)
@@ -123,16 +123,11 @@ def formatTime(self, record, datefmt=None):
             t = ct.strftime("%Y-%m-%d %H:%M:%S")
             s = "%s,%03d" % (t, record.msecs)
         return s
-logoutfile = logging.FileHandler("make_GLM_grid.log")
-formatter = MyFormatter(fmt='%(levelname)s %(asctime)s %(message)s',
-                        datefmt='%Y-%m-%dT%H:%M:%S.%f')
-logoutfile.setFormatter(formatter)
-logging.basicConfig(handlers = [logoutfile],
-                    level=logging.DEBUG)
 
 # Separate from log setup - actually log soemthign specific to this module.
+# The log file is only set up when run as a script, so importing grid_setup
+# (e.g. from scripts/benchmark/fed_grid.py) leaves no make_GLM_grid.log behind.
 log = logging.getLogger(__name__)
-log.info("Starting GLM Gridding")
 
 
 def get_goes_position(filenames):
@@ -333,6 +328,14 @@ def grid_setup(args):
     return gridder, glm_filenames, start_time, end_time, grid_kwargs
 
 if __name__ == '__main__':
+    logoutfile = logging.FileHandler("make_GLM_grid.log")
+    formatter = MyFormatter(fmt='%(levelname)s %(asctime)s %(message)s',
+                            datefmt='%Y-%m-%dT%H:%M:%S.%f')
+    logoutfile.setFormatter(formatter)
+    logging.basicConfig(handlers = [logoutfile],
+                        level=logging.DEBUG)
+    log.info("Starting GLM Gridding")
+
     parser = create_parser()
     args = parser.parse_args()
 
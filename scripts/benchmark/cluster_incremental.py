@@ -0,0 +1,105 @@
+"""Checks that incremental clustering gives the windows of a single full run.
+
+Random (t, lat, lon) cubes are fed to src/dataset/cluster_incremental.py in
+pieces of random length (or one frame at a time), with the state saved and
+loaded back between updates, for every parameter set in CASES. The windows appended over all updates are compared, as a multiset,
+with those of `generate_dataset` on the whole cube.
+Exits with status 1 if any cube differs.
+
+Example usage:
+
+    python scripts/benchmark/cluster_incremental.py --cubes 40
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.dataset.cluster_dbscan import generate_dataset
+from src.dataset.cluster_incremental import IncrementalClusterer
+
+CASES = {
+  # (clusterer parameters, one frame per update)
+  'short reach': (dict(dimensions=(4, 8, 8), radius=1.5, min_neighbors=3, min_cluster_size=4,
+                       t_scale=1, windows=(2, 4, 4), threshold=1, padding=(1, 2, 2)), False),
+  # t_scale < 1: the DBSCAN reach in frames (4) is longer than the windows,
+  # so clusters can be linked across more frames than `extent` covers
+  'long reach': (dict(dimensions=(2, 8, 8), radius=2, min_neighbors=4, min_cluster_size=4,
+                      t_scale=0.5, windows=(1, 4, 4), threshold=1, padding=(0, 2, 2)), True),
+}
+
+
+def random_cube(rng, t=60, h=24, w=24):
+  """Sparse cube with a few storms drifting over several frames."""
+  arr = np.zeros((t, h, w), dtype=np.float32)
+  for _ in range(rng.integers(3, 8)):
+    t0, length = rng.integers(0, t), rng.integers(2, 10)
+    y, x = rng.uniform(3, h - 3), rng.uniform(3, w - 3)
+    dy, dx = rng.normal(0, 0.7, 2)
+    for k in range(t0, min(t, t0 + length)):
+      yy, xx = int(y + k * dy) % h, int(x + k * dx) % w
+      arr[k, max(0, yy-2):yy+2, max(0, xx-2):xx+2] += rng.random((min(yy+2, h) - max(0, yy-2),
+                                                                  min(xx+2, w) - max(0, xx-2))) < 0.7
+  arr += rng.random(arr.shape) < 0.01
+  return arr
+
+
+def window_keys(dataset):
+  """Multiset of the windows of a dataset dict, each as (start time, lat, lon, data)."""
+  return Counter((d["time"][i, 0], d["lat"][i, 0], d["lon"][i, 0], d["FED"][:, i].tobytes())
+                 for d in dataset for i in range(d["FED"].shape[1]))
+
+
+def check(seed, params, single_frames=False):
+  rng = np.random.default_rng(seed)
+  arr = random_cube(rng)
+  t, h, w = arr.shape
+  time = np.datetime64("2022-01-01T00:00:00", "s") + np.arange(t) * np.timedelta64(300, "s")
+  lat, lon = np.arange(h, dtype=np.float32), np.arange(w, dtype=np.float32)
+  expected = window_keys([generate_dataset(arr, time, lat, lon, **params)])
+
+  clusterer = IncrementalClusterer(**params)
+  if single_frames:
+    cuts = np.arange(1, t)
+  else:
+    cuts = np.sort(rng.choice(np.arange(1, t), rng.integers(2, 8), replace=False))
+  pieces = np.split(np.arange(t), cuts)
+  got = []
+  with tempfile.TemporaryDirectory() as tmp:
+    state = os.path.join(tmp, 'state.npz')
+    for i, p in enumerate(pieces):
+      got.append(clusterer.update(arr[p], time[p], lat, lon, final=i == len(pieces) - 1))
+      clusterer.save(state)
+      clusterer = IncrementalClusterer.load(state)
+  got = window_keys(got)
+  return expected == got, sum((got - expected).values()), sum((expected - got).values())
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--cubes', type=int, default=40, help="random cubes to check")
+  parser.add_argument('--seed', type=int, default=0, help="seed of the first cube")
+  args = parser.parse_args()
+
+  failed = 0
+  for name, (params, single_frames) in CASES.items():
+    case_failed = 0
+    for seed in range(args.seed, args.seed + args.cubes):
+      ok, extra, missing = check(seed, params, single_frames)
+      if not ok:
+        case_failed += 1
+        print(f"{name}, seed {seed}: {extra} extra and {missing} missing windows")
+    print(f"{name}: {args.cubes - case_failed}/{args.cubes} cubes match a full run")
+    failed += case_failed
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  main()
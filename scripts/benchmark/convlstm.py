@@ -0,0 +1,72 @@
+"""CPU benchmark of CLSTM_cell against the original per-timestep concat + conv loop.
+
+Example usage:
+
+    python scripts/benchmark/convlstm.py --batchsize 16 --features 64 --seq-len 10
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.layers.ConvLSTM2D import CLSTM_cell
+
+
+def reference_forward(cell, inputs, hidden_state):
+  """The original CLSTM_cell.forward: one conv over cat(x, h) per timestep."""
+  hx, cx = hidden_state
+  output_inner = []
+  for index in range(inputs.size(0)):
+    combined = torch.cat((inputs[index], hx), 1)
+    gates = cell.conv(combined)
+    ingate, forgetgate, cellgate, outgate = torch.split(gates, cell.num_features, dim=1)
+    cy = (torch.sigmoid(forgetgate) * cx) + (torch.sigmoid(ingate) * torch.tanh(cellgate))
+    hy = torch.sigmoid(outgate) * torch.tanh(cy)
+    output_inner.append(hy)
+    hx, cx = hy, cy
+  return torch.stack(output_inner), (hy, cy)
+
+
+def timeit(fn, repeats):
+  fn()
+  start = time.perf_counter()
+  for _ in range(repeats):
+    fn()
+  return (time.perf_counter() - start) / repeats
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--batchsize', type=int, default=16)
+  parser.add_argument('--channels', type=int, default=1)
+  parser.add_argument('--features', type=int, default=64)
+  parser.add_argument('--size', type=int, default=64)
+  parser.add_argument('--seq-len', type=int, default=10)
+  parser.add_argument('--filter-size', type=int, default=5)
+  parser.add_argument('--repeats', type=int, default=10)
+  args = parser.parse_args()
+
+  torch.manual_seed(0)
+  cell = CLSTM_cell((args.size, args.size), args.channels, args.filter_size, args.features).eval()
+  inputs = torch.rand(args.seq_len, args.batchsize, args.channels, args.size, args.size)
+  zeros = torch.zeros(args.batchsize, args.features, args.size, args.size)
+  hidden = (zeros, zeros)
+
+  with torch.no_grad():
+    expected, _ = reference_forward(cell, inputs, hidden)
+    actual, _ = cell(inputs, hidden)
+    print(f"max abs difference: {(expected - actual).abs().max().item():.2e}")
+    reference = timeit(lambda: reference_forward(cell, inputs, hidden), args.repeats)
+    current = timeit(lambda: cell(inputs, hidden), args.repeats)
+  print(f"reference: {reference*1000:.1f} ms/sequence batch")
+  print(f"CLSTM_cell: {current*1000:.1f} ms/sequence batch ({reference/current:.2f}x)")
+
+
+if __name__ == '__main__':
+  main()
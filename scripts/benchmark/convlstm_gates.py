@@ -0,0 +1,91 @@
+"""Micro-benchmark of the ConvLSTM gate update: time and tensor allocations per step.
+
+Compares `gate_update` (split + separate activations, new tensors) against
+`fused_gate_update` (in-place activations and reused buffers).
+
+Example usage:
+
+    python scripts/benchmark/convlstm_gates.py --batchsize 16 --features 64
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_leaves
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.layers.ConvLSTM2D import gate_update, fused_gate_update
+
+
+class AllocationCounter(TorchDispatchMode):
+  """Counts the op outputs that live in new storage rather than in one of the op's inputs."""
+
+  def __init__(self):
+    super().__init__()
+    self.count = 0
+    self.bytes = 0
+
+  def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+    out = func(*args, **(kwargs or {}))
+    storages = {t.untyped_storage().data_ptr()
+                for t in tree_leaves((args, kwargs)) if isinstance(t, torch.Tensor)}
+    for t in tree_leaves(out):
+      if isinstance(t, torch.Tensor) and t.untyped_storage().data_ptr() not in storages:
+        self.count += 1
+        self.bytes += t.untyped_storage().nbytes()
+    return out
+
+
+def count_allocations(fn):
+  with AllocationCounter() as counter:
+    fn()
+  return f"{counter.count} allocations ({counter.bytes / 2**20:.1f} MiB)"
+
+
+def timeit(fn, repeats):
+  fn()
+  start = time.perf_counter()
+  for _ in range(repeats):
+    fn()
+  return (time.perf_counter() - start) / repeats
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--batchsize', type=int, default=16)
+  parser.add_argument('--features', type=int, default=64)
+  parser.add_argument('--size', type=int, default=64)
+  parser.add_argument('--repeats', type=int, default=50)
+  args = parser.parse_args()
+
+  torch.manual_seed(0)
+  F = args.features
+  gates = torch.randn(args.batchsize, 4 * F, args.size, args.size)
+  cx = torch.randn(args.batchsize, F, args.size, args.size)
+  hy = torch.empty_like(cx)
+  buffer = torch.empty_like(cx)
+  # the fused update overwrites its inputs, work on copies refreshed outside the timed region
+  fused_gates, fused_cx = gates.clone(), cx.clone()
+
+  with torch.inference_mode():
+    expected_h, expected_c = gate_update(gates, cx, F)
+    actual_h, actual_c = fused_gate_update(fused_gates, fused_cx, hy, buffer, F)
+    print(f"max abs difference: h={(expected_h - actual_h).abs().max().item():.2e}, "
+          f"c={(expected_c - actual_c).abs().max().item():.2e}")
+
+    allocating = lambda: gate_update(gates, cx, F)
+    fused = lambda: fused_gate_update(fused_gates, fused_cx, hy, buffer, F)
+    print(f"gate_update:       {timeit(allocating, args.repeats)*1000:.2f} ms/step, "
+          f"{count_allocations(allocating)}/step")
+    print(f"fused_gate_update: {timeit(fused, args.repeats)*1000:.2f} ms/step, "
+          f"{count_allocations(fused)}/step")
+
+
+if __name__ == '__main__':
+  main()
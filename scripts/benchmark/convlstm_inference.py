@@ -0,0 +1,63 @@
+"""CPU inference throughput of CLSTM_cell, in sequences per second.
+
+Runs under torch.inference_mode for every combination of memory format and
+compile mode requested, to size CPU inference nodes.
+
+Example usage:
+
+    python scripts/benchmark/convlstm_inference.py --threads 8 --modes eager script compile
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.layers.ConvLSTM2D import CLSTM_cell, compile_cell
+
+
+def throughput(cell, inputs, repeats):
+  with torch.inference_mode():
+    cell(inputs)
+    start = time.perf_counter()
+    for _ in range(repeats):
+      cell(inputs)
+    elapsed = time.perf_counter() - start
+  return repeats * inputs.size(1) / elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--batchsize', type=int, default=16)
+  parser.add_argument('--channels', type=int, default=1)
+  parser.add_argument('--features', type=int, default=64)
+  parser.add_argument('--size', type=int, default=64)
+  parser.add_argument('--seq-len', type=int, default=10)
+  parser.add_argument('--filter-size', type=int, default=5)
+  parser.add_argument('--repeats', type=int, default=10)
+  parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+  parser.add_argument('--modes', nargs='+', default=['eager', 'script'], choices=['eager', 'script', 'compile'])
+  args = parser.parse_args()
+
+  torch.set_num_threads(args.threads)
+  torch.manual_seed(0)
+  inputs = torch.rand(args.seq_len, args.batchsize, args.channels, args.size, args.size)
+  print(f"threads={args.threads}, input={tuple(inputs.shape)}, features={args.features}")
+  for channels_last in (False, True):
+    for mode in args.modes:
+      cell = CLSTM_cell((args.size, args.size), args.channels, args.filter_size, args.features).eval()
+      if channels_last:
+        cell = cell.to_channels_last()
+      cell = compile_cell(cell, None if mode == 'eager' else mode)
+      rate = throughput(cell, inputs, args.repeats)
+      layout = "channels_last" if channels_last else "contiguous"
+      print(f"{mode:>8} {layout:>14}: {rate:.2f} sequences/s")
+
+
+if __name__ == '__main__':
+  main()
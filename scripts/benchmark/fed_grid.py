@@ -0,0 +1,103 @@
+"""Benchmark of the NumPy FED gridder (src/dataset/fed_grid.py) against glmtools.
+
+Without files, flashes are drawn at random over the Peru domain and only the
+binning is timed (against np.histogramdd as a reference). With LCFA files, the
+read and grid steps are timed separately and, if glmtools is installed, the
+same files are gridded with make_GLM_grids.grid_setup over the same domain.
+
+Example usage:
+
+    python scripts/benchmark/fed_grid.py --flashes 1000000
+    python scripts/benchmark/fed_grid.py --spatial 8 --temporal 1 /data/GLM-L2-LCFA/2019/001/00/*.nc
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.dataset.fed_grid import PERU_N, PERU_S, PERU_E, PERU_W, grid_flashes, read_files
+
+
+def timeit(fn, repeats):
+  result = fn()
+  start = time.perf_counter()
+  for _ in range(repeats):
+    fn()
+  return (time.perf_counter() - start) / repeats, result
+
+
+def synthetic_flashes(n, minutes, seed=0):
+  rng = np.random.default_rng(seed)
+  lat = rng.uniform(PERU_S - 1, PERU_N + 1, n).astype(np.float32)
+  lon = rng.uniform(PERU_W - 1, PERU_E + 1, n).astype(np.float32)
+  ms = rng.integers(0, minutes * 60_000, n).astype("timedelta64[ms]")
+  return lat, lon, np.datetime64("2019-01-01T00:00") + ms
+
+
+def histogramdd(lat, lon, time, t_edges, lat_edges, lon_edges):
+  t = (time - t_edges[0]).astype(np.float64)
+  t_bins = (t_edges - t_edges[0]).astype(np.float64)
+  fed, _ = np.histogramdd((t, lat, lon), bins=(t_bins, lat_edges, lon_edges))
+  return fed.astype(np.float32)
+
+
+def glmtools_grid(filenames, spatial, temporal):
+  """Grids the files with glmtools on a lat/lon grid centered on the Peru domain."""
+  sys.path.append(os.path.join(current_folder, '../OLD'))
+  from make_GLM_grids import create_parser, grid_setup
+  ctr_lat, ctr_lon = (PERU_N + PERU_S) / 2, (PERU_E + PERU_W) / 2
+  height = (PERU_N - PERU_S) * 110.54
+  width = (PERU_E - PERU_W) * 111.32 * np.cos(np.deg2rad(ctr_lat))
+  with tempfile.TemporaryDirectory() as outdir:
+    args = create_parser().parse_args([
+      '--ctr_lat', str(ctr_lat), '--ctr_lon', str(ctr_lon),
+      '--width', str(width), '--height', str(height),
+      '--dx', str(spatial), '--dy', str(spatial), '--dt', str(temporal * 60),
+      '-o', os.path.join(outdir, '{dataset_name}'), *filenames])
+    gridder, glm_filenames, start_time, end_time, grid_kwargs = grid_setup(args)
+    start = time.perf_counter()
+    gridder(glm_filenames, start_time, end_time, **grid_kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--spatial', type=float, default=8, help="cell size in km")
+  parser.add_argument('--temporal', type=int, default=5, help="frame length in minutes")
+  parser.add_argument('--flashes', type=int, default=1_000_000, help="synthetic flashes when no files are given")
+  parser.add_argument('--minutes', type=int, default=60, help="time span of the synthetic flashes")
+  parser.add_argument('--repeats', type=int, default=5)
+  parser.add_argument('filenames', nargs='*', help="GLM L2 LCFA files")
+  args = parser.parse_args()
+
+  if args.filenames:
+    read_s, (lat, lon, t) = timeit(lambda: read_files(args.filenames), 1)
+    print(f"read {len(args.filenames)} files ({len(lat)} flashes): {read_s:.3f}s")
+  else:
+    lat, lon, t = synthetic_flashes(args.flashes, args.minutes)
+
+  grid = lambda: grid_flashes(lat, lon, t, args.spatial, args.temporal)
+  grid_s, (fed, t_edges, lat_edges, lon_edges) = timeit(grid, args.repeats)
+  print(f"numpy bincount: {grid_s*1000:.1f} ms for {len(lat)} flashes -> {fed.shape} "
+        f"({len(lat)/grid_s/1e6:.1f} M flashes/s)")
+
+  ref_s, ref = timeit(lambda: histogramdd(lat, lon, t, t_edges, lat_edges, lon_edges), args.repeats)
+  print(f"np.histogramdd: {ref_s*1000:.1f} ms ({ref_s/grid_s:.1f}x), cells differing: {int((ref != fed).sum())}")
+
+  if args.filenames:
+    try:
+      glm_s = glmtools_grid(args.filenames, args.spatial, args.temporal)
+      print(f"glmtools: {glm_s:.3f}s ({glm_s/(read_s + grid_s):.1f}x read + grid)")
+    except ImportError as e:
+      print(f"glmtools not available ({e}), skipped")
+
+
+if __name__ == '__main__':
+  main()
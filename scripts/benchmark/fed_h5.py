@@ -0,0 +1,105 @@
+"""File size and read throughput of a FED dataset rewritten with different layouts.
+
+The input (an existing dataset.h5, or synthetic binary storm windows) is
+rechunked with src/dataset/fed_writer.py into every combination given (and
+converted to the sparse format of src/dataset/sparse.py), and each file is
+read as SequenceFED does: shuffled batches with `take` and one sequential
+pass with `read`.
+
+Example usage:
+
+    python scripts/benchmark/fed_h5.py data/training/dataset.h5
+    python scripts/benchmark/fed_h5.py --samples 2000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.dataset.SequenceFED import open_file
+from src.dataset.fed_writer import rechunk
+from src.dataset.sparse import write_sparse
+
+LAYOUTS = [
+  # (name, chunk_samples, codec, storage)
+  ('gzip float', 1, 'gzip', 'native'),
+  ('lzf float', 1, 'lzf', 'native'),
+  ('lzf uint8', 1, 'lzf', 'uint8'),
+  ('lzf bits', 1, 'lzf', 'bits'),
+  ('lzf bits x16', 16, 'lzf', 'bits'),
+  ('raw bits', 1, 'none', 'bits'),
+  ('gzip sparse', None, 'gzip', 'sparse'),
+]
+
+
+def synthetic(path, samples, seed=0):
+  """Binary windows with a blob of activity each, like the --binary clusters; stored like cluster_grid.jl."""
+  rng = np.random.default_rng(seed)
+  t, w, h = 20, 64, 64
+  yy, xx = np.mgrid[:w, :h]
+  with h5py.File(path, 'w') as f:
+    fed = f.create_dataset('FED', (t, samples, 1, w, h), dtype=np.float32, compression='gzip', compression_opts=1)
+    for start in range(0, samples, 100):
+      k = min(100, samples - start)
+      cy, cx, r = (rng.uniform(lo, hi, (k, 1, 1)) for lo, hi in ((16, 48), (16, 48), (4, 14)))
+      blobs = (yy - cy)**2 + (xx - cx)**2 < r**2
+      fed[:, start:start+k, 0] = blobs & (rng.random((t, k, w, h)) < 0.5)
+
+
+def read_speed(path, batchsize, batches, seed=0):
+  f = open_file(path)
+  n = len(f)
+  rng = np.random.default_rng(seed)
+  start = time.perf_counter()
+  for _ in range(batches):
+    f.take(rng.choice(n, batchsize, replace=False))
+  random_s = (time.perf_counter() - start) / (batches * batchsize)
+  start = time.perf_counter()
+  for i in range(0, n, 256):
+    f.read(i, min(i + 256, n))
+  sequential_s = (time.perf_counter() - start) / n
+  f.close()
+  return random_s, sequential_s
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--samples', type=int, default=1000, help="synthetic windows when no file is given")
+  parser.add_argument('--batchsize', type=int, default=16)
+  parser.add_argument('--batches', type=int, default=50)
+  parser.add_argument('file', nargs='?', help="FED dataset file (default: synthetic)")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    src = args.file
+    if src is None:
+      src = os.path.join(tmp, 'synthetic.h5')
+      synthetic(src, args.samples)
+    print(f"{'layout':<14} {'MiB':>8} {'random ms/sample':>17} {'sequential ms/sample':>21}")
+    rows = [('original', src)]
+    for name, chunk_samples, codec, storage in LAYOUTS:
+      dst = os.path.join(tmp, name.replace(' ', '_') + '.h5')
+      try:
+        if storage == 'sparse':
+          write_sparse(src, dst, compression=codec)
+        else:
+          rechunk(src, dst, chunk_samples, codec, storage)
+      except ValueError as e:
+        print(f"{name:<14} skipped: {e}")
+        continue
+      rows.append((name, dst))
+    for name, path in rows:
+      random_s, sequential_s = read_speed(path, args.batchsize, args.batches)
+      print(f"{name:<14} {os.path.getsize(path) / 2**20:8.1f} {random_s * 1e3:17.3f} {sequential_s * 1e3:21.3f}")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,61 @@
+"""Compares train_step time and compiled memory of the fp32 and bf16 precision policies.
+
+Example usage:
+
+    python scripts/benchmark/precision.py --batchsize=16 --features=32 --steps=20
+"""
+
+import os
+import sys
+import time
+
+from absl import app
+from absl import flags
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from scripts.training.trainseq2seq import Seq2seq, get_train_state, train_step
+from src.training.precision import POLICIES
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('batchsize', default=16, help="")
+flags.DEFINE_integer('features', default=32, help="")
+flags.DEFINE_integer('N', default=10, help="Input frames")
+flags.DEFINE_integer('out', default=10, help="Output frames")
+flags.DEFINE_integer('steps', default=20, help="Timed steps per policy")
+
+
+def benchmark(name, policy):
+  model = Seq2seq(out_length=FLAGS.out, features=FLAGS.features)
+  rng = jax.random.PRNGKey(0)
+  X = jnp.asarray(np.random.rand(FLAGS.N, FLAGS.batchsize, 64, 64, 1) > 0.95, dtype=jnp.float32)
+  y = jnp.asarray(np.random.rand(FLAGS.out, FLAGS.batchsize, 64, 64, 1) > 0.95, dtype=jnp.float32)
+  variables = model.init({'params': rng, 'lstm': rng}, X.astype(policy.compute_dtype))
+  variables = jax.tree_util.tree_map(lambda p: p.astype(policy.param_dtype), variables)
+  state = get_train_state(model, variables['params'], 1e-3)
+
+  memory = train_step.lower(state, X, y, rng, policy).compile().memory_analysis()
+  state, _ = train_step(state, X, y, rng, policy)
+  jax.block_until_ready(state)
+  start = time.perf_counter()
+  for _ in range(FLAGS.steps):
+    state, metrics = train_step(state, X, y, rng, policy)
+  jax.block_until_ready(state)
+  elapsed = (time.perf_counter() - start) / FLAGS.steps
+  temp = memory.temp_size_in_bytes / 2**20 if memory is not None else float('nan')
+  print(f"{name}: {elapsed*1000:.1f} ms/step, {temp:.1f} MiB temporaries, loss={float(metrics['loss']):.3f}")
+
+
+def main(_):
+  print(f"devices: {jax.devices()}")
+  for name, policy in POLICIES.items():
+    benchmark(name, policy)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,140 @@
+"""Python counterpart of cluster_grid.jl: storm-cluster windows of FED grids into HDF5.
+
+Takes the same arguments as the cluster_dataset stage (per-dimension tuples in
+lon,lat,time order) and writes one HDF5 per input grid, in the "FED" layout
+read by SequenceFED, to data/exp_pro/GLM-L2-LCFA-BOXES/<experiment id>/.
+
+Example usage:
+
+    python scripts/dataset/cluster_grid.py \\
+        --folder=data/exp_pro/GLM-L2-LCFA-GRID/spatial=8_temporal=5_year=2019 \\
+        --threshold=1.0 --binary --radius=3.0 --time_scale=2.0 --windows=5,5,10 \\
+        --min_neighbors=32 --min_cluster_size=64 --dimensions=64,64,20 --padding=2,2,4 \\
+        --single-file=dataset.h5
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+import h5py
+import numpy as np
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.dataset.cluster_dbscan import generate_dataset
+from src.dataset.cluster_incremental import create_resizable
+from src.dataset.fed_grid import read_fed
+from src.utils import drwatson
+
+log = logging.getLogger(__name__)
+
+
+def ntuple(x):
+  """'5,5,10' (lon, lat, time) -> (10, 5, 5) (time, lat, lon)."""
+  lon, lat, time = (int(v) for v in x.split(','))
+  return (time, lat, lon)
+
+
+def create_parser():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--file', '-f', action='append', default=[],
+                      help="file to process (expects to be the output of grid_fed.jl)")
+  parser.add_argument('--windows', '-w', type=ntuple, default='0,0,0',
+                      help="size of moving window for each dimension (lon, lat, time)")
+  parser.add_argument('--dimensions', '-d', type=ntuple, default='64,64,20', help="size of the patches (lon, lat, time)")
+  parser.add_argument('--radius', '-r', type=float, required=True, help="radius for dbscan")
+  parser.add_argument('--min_neighbors', type=int, required=True, help="minimum neighbors for dbscan")
+  parser.add_argument('--min_cluster_size', type=int, required=True, help="minimum cluster size for dbscan")
+  parser.add_argument('--time_scale', type=float, default=1.0, help="factor to scale time for dbscan")
+  parser.add_argument('--binary', action='store_true', help="to transform the dataset into binary classification")
+  parser.add_argument('--compression', type=int, default=1, choices=range(10), help="compression level for output file")
+  parser.add_argument('--folder', help="Folder instead of files")
+  parser.add_argument('--threshold', type=float, default=0.0, help="threshold for filtering and binarization")
+  parser.add_argument('--padding', type=ntuple, default='0,0,0', help="Padding to add to windows (lon, lat, time)")
+  parser.add_argument('--single-file', default=None, help="File to output")
+  return parser
+
+
+def experiment_id(args, input_folder_params):
+  lon_lat_time = lambda t: tuple(reversed(t))
+  return drwatson.savename(dict(
+    binary=str(args.binary).lower(),
+    spatial=input_folder_params["spatial"],
+    temporal=input_folder_params["temporal"],
+    threshold=args.threshold,
+    radius=args.radius,
+    min_neighbors=args.min_neighbors,
+    min_cluster_size=args.min_cluster_size,
+    t_scale=args.time_scale,
+    windows=lon_lat_time(args.windows),
+    dimensions=lon_lat_time(args.dimensions),
+    padding=lon_lat_time(args.padding),
+  ), sort=False, allowedtypes=(int, float, str, tuple))
+
+
+def write_dataset(path, dataset, compression):
+  # resizable along the sample axis, so cluster_update.py can append to it
+  with h5py.File(path, "w") as f:
+    for key, val in dataset.items():
+      create_resizable(f, key, val, compression)
+
+
+def join_all(folder, fname, compression):
+  files = sorted(os.path.join(folder, x) for x in os.listdir(folder) if x.endswith(".h5"))
+  with h5py.File(fname, "w") as out:
+    for key, axis in (("FED", 1), ("lon", 0), ("lat", 0), ("time", 0)):
+      arrs = []
+      for p in files:
+        with h5py.File(p, "r") as f:
+          arrs.append(f[key][:])
+      create_resizable(out, key, np.concatenate(arrs, axis=axis), compression)
+
+
+def main():
+  args = create_parser().parse_args()
+  logging.basicConfig(level=logging.INFO)
+  files = args.file or sorted(os.path.join(args.folder, x) for x in os.listdir(args.folder))
+  assert len(files) > 0
+
+  _, input_folder_params, _ = drwatson.parse_savename(os.path.normpath(args.folder or os.path.dirname(files[0])))
+  parent_folder = drwatson.datadir("exp_pro", "GLM-L2-LCFA-BOXES", experiment_id(args, input_folder_params))
+  os.makedirs(parent_folder, exist_ok=True)
+
+  log.info("Starting processing")
+  for file in files:
+    log.info(f"Read file {file}")
+    fed, time, lat, lon = read_fed(file)
+    log.info(f"Processing {file}")
+    try:
+      dataset = generate_dataset(fed, time, lat, lon, args.dimensions,
+                                 radius=args.radius,
+                                 min_neighbors=args.min_neighbors,
+                                 min_cluster_size=args.min_cluster_size,
+                                 t_scale=args.time_scale,
+                                 windows=args.windows,
+                                 threshold=args.threshold,
+                                 padding=args.padding)
+    except Exception as e:
+      log.warning(f"Skipping {os.path.basename(file)}:\n{e!r}")
+      continue
+    _, instance_id, _ = drwatson.parse_savename(file)
+    _, instance_folder_id, _ = drwatson.parse_savename(os.path.dirname(file))
+    instance_id = dict(basename=instance_folder_id["year"], month=instance_id["month"], compression=args.compression)
+    filepath = os.path.join(parent_folder, drwatson.savename(instance_id, "h5", sort=False))
+    if args.binary:
+      dataset["FED"] = (dataset["FED"] >= args.threshold).astype(np.uint8)
+    log.info(f"saving {dataset['FED'].shape[1]} clusters to {os.path.basename(filepath)}")
+    write_dataset(filepath, dataset, args.compression)
+
+  if args.single_file is not None:
+    log.info("joining into single file")
+    p = os.path.join("data/training", args.single_file)
+    os.makedirs(os.path.dirname(p), exist_ok=True)
+    join_all(parent_folder, p, args.compression)
+
+
+if __name__ == '__main__':
+  main()
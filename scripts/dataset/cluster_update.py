@@ -0,0 +1,93 @@
+"""Appends the storm-cluster windows of newly gridded FED frames to an existing dataset.
+
+Keeps the state of src/dataset/cluster_incremental.py out of the dataset
+folder (which SequenceFED reads whole), under
+data/exp_pro/GLM-L2-LCFA-BOXES/state/, so every run only clusters the new
+frames plus the trailing frames of the clusters still open. The clustering arguments are
+those of cluster_grid.py; on later runs they are read back from the state.
+
+Example usage:
+
+    python scripts/dataset/cluster_update.py --threshold=1.0 --binary --radius=3.0 --time_scale=2.0 \\
+        --windows=5,5,10 --min_neighbors=32 --min_cluster_size=64 --dimensions=64,64,20 --padding=2,2,4 \\
+        --output=data/training/dataset.h5 new_day.nc
+"""
+
+import hashlib
+import logging
+import os
+import sys
+
+import numpy as np
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from scripts.dataset.cluster_grid import create_parser as create_cluster_parser
+from src.dataset.cluster_incremental import IncrementalClusterer, append_windows
+from src.dataset.fed_grid import read_fed
+from src.utils import drwatson
+
+log = logging.getLogger(__name__)
+
+
+def default_state_path(output):
+  """State file of the dataset `output`, named after it and a hash of its absolute path."""
+  name = os.path.splitext(os.path.basename(output))[0]
+  digest = hashlib.sha1(os.path.abspath(output).encode()).hexdigest()[:8]
+  return drwatson.datadir("exp_pro", "GLM-L2-LCFA-BOXES", "state", f"{name}_{digest}.state.npz")
+
+
+def create_parser():
+  parser = create_cluster_parser()
+  parser.description = __doc__
+  for action in parser._actions:
+    if action.dest in ('radius', 'min_neighbors', 'min_cluster_size'):
+      action.required = False
+  parser.add_argument('--output', default='data/training/dataset.h5', help="dataset file windows are appended to")
+  parser.add_argument('--state', default=None, help="clusterer state, an .npz file outside the dataset folder "
+                           "(default: data/exp_pro/GLM-L2-LCFA-BOXES/state/<output name>_<hash>.state.npz)")
+  parser.add_argument('--final', action='store_true', help="the frames end here: close every open cluster")
+  parser.add_argument('grids', nargs='*', help="FED grids with the new frames, in time order")
+  return parser
+
+
+def main():
+  parser = create_parser()
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+  state_path = args.state or default_state_path(args.output)
+  os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+
+  if os.path.exists(state_path):
+    clusterer = IncrementalClusterer.load(state_path)
+    log.info(f"resuming at frame {clusterer.end} ({len(clusterer.buffer)} buffered)")
+  else:
+    if None in (args.radius, args.min_neighbors, args.min_cluster_size):
+      parser.error("--radius, --min_neighbors and --min_cluster_size are required for a new dataset")
+    clusterer = IncrementalClusterer(args.dimensions, radius=args.radius, min_neighbors=args.min_neighbors,
+                                     min_cluster_size=args.min_cluster_size, t_scale=args.time_scale,
+                                     windows=args.windows, threshold=args.threshold, padding=args.padding)
+
+  def append(dataset):
+    if args.binary:
+      dataset["FED"] = (dataset["FED"] >= clusterer.params["threshold"]).astype(np.uint8)
+    n = dataset["FED"].shape[1]
+    if n:
+      path = append_windows(args.output, dataset, args.compression)
+      if path != args.output:
+        log.info(f"{args.output} cannot be resized, windows written to {path}")
+    return n
+
+  files = list(args.grids) + args.file
+  for i, file in enumerate(files):
+    fed, time, lat, lon = read_fed(file)
+    n = append(clusterer.update(fed, time, lat, lon, final=args.final and i == len(files) - 1))
+    log.info(f"{os.path.basename(file)}: appended {n} windows, {len(clusterer.buffer)} frames buffered")
+  if args.final and not files:
+    append(clusterer.update(clusterer.buffer[:0], clusterer.time[:0], clusterer.lat, clusterer.lon, final=True))
+  clusterer.save(state_path)
+
+
+if __name__ == '__main__':
+  main()
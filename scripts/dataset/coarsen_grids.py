@@ -0,0 +1,114 @@
+"""Coarsens a directory of flash_density_*.nc frames into a single (time, lat, lon) HDF5 cube.
+
+Every frame is block-summed with src/OLD/grilla.py on a pool of processes
+(several frames per task, coarsened as one stack) and written in time order
+to the "FED" dataset of the output file, next to its "time", "lat" and "lon"
+coordinates. The cube is chunked along time and compressed by default; with
+--compression none it is stored contiguously, so it can be memory-mapped.
+
+Example usage:
+
+    python scripts/dataset/coarsen_grids.py --factor 4 --workers 8 dat_new/ fed_8km.h5
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+from datetime import datetime
+from glob import glob
+
+import h5py
+import numpy as np
+from netCDF4 import Dataset
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.OLD.grilla import regrid
+
+FRAME_PATTERN = 'flash_density_*.nc'
+
+
+def frame_time(path):
+  """Start time of a frame from its name, e.g. flash_density_20210101-001500.nc."""
+  stamp = os.path.basename(path)[len('flash_density_'):-len('.nc')]
+  return datetime.strptime(stamp, '%Y%m%d-%H%M%S')
+
+
+def read_frame(path, variable='density'):
+  with Dataset(path) as f:
+    density = f.variables[variable][:]
+    lat = f.variables['latitude'][:]
+    lon = f.variables['longitude'][:]
+  # frames are (lat, lon), possibly with a leading time axis of length 1
+  return density.reshape(density.shape[-2:]), lat, lon
+
+
+def coarsen_frames(task):
+  """Reads and coarsens a block of frames in one call; runs in a worker."""
+  paths, factor, edge, fill = task
+  frames = [read_frame(p) for p in paths]
+  stack = np.ma.stack([density for density, _, _ in frames])
+  density, lat, lon = regrid(stack, frames[0][1], frames[0][2], factor, edge)
+  return np.ma.filled(density, fill).astype(np.float32), np.ma.filled(lat, np.nan), np.ma.filled(lon, np.nan)
+
+
+def create_cube(f, n_frames, lat, lon, times, chunk_frames, compression):
+  if compression == 'none':
+    options = {}
+  else:
+    options = dict(chunks=(min(chunk_frames, n_frames), len(lat), len(lon)), shuffle=True,
+                   compression=compression, compression_opts=4 if compression == 'gzip' else None)
+  fed = f.create_dataset('FED', (n_frames, len(lat), len(lon)), dtype=np.float32, **options)
+  f.create_dataset('lat', data=lat.astype(np.float32))
+  f.create_dataset('lon', data=lon.astype(np.float32))
+  t = f.create_dataset('time', data=np.array(times, dtype='datetime64[s]').astype(np.int64))
+  t.attrs['units'] = 'seconds since 1970-01-01 00:00:00'
+  for name, dim in (('time', 0), ('lat', 1), ('lon', 2)):
+    f[name].make_scale(name)
+    fed.dims[dim].attach_scale(f[name])
+  return fed
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--factor', type=int, default=4, help="cells per block along lat and lon (default: 4, 2km -> 8km)")
+  parser.add_argument('--edge', default='trim', choices=['trim', 'pad'],
+                      help="drop the incomplete edge blocks or keep them as partial sums (default: trim)")
+  parser.add_argument('--fill', type=float, default=0.0, help="value of blocks without any valid cell (default: 0)")
+  parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="worker processes (default: one per core)")
+  parser.add_argument('--frames-per-task', type=int, default=32, help="frames coarsened together by a worker (default: 32)")
+  parser.add_argument('--chunk-frames', type=int, default=32, help="frames per HDF5 chunk (default: 32)")
+  parser.add_argument('--compression', default='gzip', choices=['gzip', 'lzf', 'none'],
+                      help="codec of the cube; 'none' stores it contiguously for memory-mapping (default: gzip)")
+  parser.add_argument('input_dir', help="directory searched recursively for {} frames".format(FRAME_PATTERN))
+  parser.add_argument('output', help="HDF5 file to create")
+  args = parser.parse_args()
+
+  paths = sorted(glob(os.path.join(args.input_dir, '**', FRAME_PATTERN), recursive=True), key=frame_time)
+  if not paths:
+    parser.error("no {} files found in {}".format(FRAME_PATTERN, args.input_dir))
+  times = [frame_time(p) for p in paths]
+  tasks = [(paths[i:i+args.frames_per_task], args.factor, args.edge, args.fill)
+           for i in range(0, len(paths), args.frames_per_task)]
+
+  with multiprocessing.Pool(args.workers) as pool, h5py.File(args.output, 'w') as f:
+    fed = None
+    start = 0
+    # imap keeps the frames in time order while later blocks are already being coarsened
+    for density, lat, lon in pool.imap(coarsen_frames, tasks):
+      if fed is None:
+        fed = create_cube(f, len(paths), lat, lon, times, args.chunk_frames, args.compression)
+      if density.shape[1:] != fed.shape[1:]:
+        raise ValueError("frames {}.. have a {} grid, expected {}".format(paths[start], density.shape[1:], fed.shape[1:]))
+      fed[start:start+len(density)] = density
+      start += len(density)
+      print("{}/{} frames".format(start, len(paths)), end='\r', flush=True)
+    fed.attrs['factor'] = args.factor
+    fed.attrs['source'] = os.path.abspath(args.input_dir)
+    print("\nwrote FED {} to {}".format(fed.shape, args.output))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,44 @@
+"""Rewrites FED dataset files with sample-major chunks, a fast codec and optional binary packing.
+
+With --storage sparse the windows are stored as the coordinates of their
+active voxels (src/dataset/sparse.py), loaded whole in memory and densified
+per batch; --chunk-samples does not apply.
+
+Example usage:
+
+    python scripts/dataset/rechunk_fed.py --codec lzf --storage bits data/training/dataset.h5 data/training/dataset_bits.h5
+    python scripts/dataset/rechunk_fed.py --codec gzip --storage sparse data/training/dataset.h5 data/training/dataset_sparse.h5
+"""
+
+import argparse
+import os
+import sys
+
+current_folder = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(current_folder, '../..'))
+from src.dataset.fed_writer import CODECS, STORAGE, rechunk
+from src.dataset.sparse import write_sparse
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--chunk-samples', type=int, default=1, help="samples per chunk (default: 1)")
+  parser.add_argument('--codec', default='lzf', choices=list(CODECS), help="compression codec (default: lzf)")
+  parser.add_argument('--storage', default='native', choices=STORAGE + ('sparse',),
+                      help="'uint8' or 'bits' (8 cells per byte) for the --binary clusters, "
+                           "'sparse' for active voxel coordinates (default: native)")
+  parser.add_argument('src', help="FED file to read")
+  parser.add_argument('dst', help="FED file to write")
+  args = parser.parse_args()
+
+  if args.storage == 'sparse':
+    write_sparse(args.src, args.dst, compression=CODECS[args.codec].get('compression'))
+  else:
+    rechunk(args.src, args.dst, args.chunk_samples, args.codec, args.storage)
+  print("{}: {:.1f} MiB -> {}: {:.1f} MiB".format(args.src, os.path.getsize(args.src) / 2**20,
+                                                   args.dst, os.path.getsize(args.dst) / 2**20))
+
+
+if __name__ == '__main__':
+  main()
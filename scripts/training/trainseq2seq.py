@@ -30,7 +30,8 @@
     config.FLAGS.jax_backend_target = "grpc://" + os.environ['COLAB_TPU_ADDR']
     print(config.FLAGS.jax_backend_target)
 
-from typing import Any, Dict, Tuple
+import functools
+from typing import Any, Dict, Optional, Tuple
 
 from absl import flags
 from absl import app
@@ -39,15 +40,20 @@
 import jax
 import jax.numpy as jnp
 import optax
-from flax.training import train_state, checkpoints
+from flax import jax_utils
 import sys
 
 current_folder = os.path.dirname(os.path.realpath(__file__))
 
 sys.path.append(os.path.join(current_folder, '../..'))
 from src.architecture.Seq2Seq01 import Seq2seq
-from src.dataset.SequenceFED import get_dataset
+from src.dataset.cache import ArrayCache
+from src.dataset.SequenceFED import SequenceFED
+from src.evaluation import metrics as eval_metrics
+from src.training.checkpoint import AsyncCheckpointer
+from src.training.precision import POLICIES, Policy
 from src.utils import drwatson
+from src.utils.timing import EpochTimer
 
 
 Array = Any
@@ -59,6 +65,18 @@
 flags.DEFINE_string('dataset_path', default=".", help="")
 flags.DEFINE_integer('epochs', default=None, help="")
 flags.DEFINE_string('optimiser', default=None, help="")
+flags.DEFINE_integer('prefetch', default=2, help="Batches read ahead of the training step (0 disables prefetching)")
+flags.DEFINE_integer('prefetch_workers', default=1, help="Threads reading prefetched batches")
+flags.DEFINE_bool('multi_device', default=False, help="Split every batch across all local devices (data parallel)")
+flags.DEFINE_integer('scan_steps', default=1, help="Optimizer steps fused into one compiled lax.scan call")
+flags.DEFINE_integer('checkpoint_keep', default=3, help="Most recent checkpoints kept on disk")
+flags.DEFINE_integer('checkpoint_keep_best', default=1, help="Checkpoints with the best --checkpoint_metric kept on disk")
+flags.DEFINE_string('checkpoint_metric', default='loss', help="Metric used to rank checkpoints")
+flags.DEFINE_enum('checkpoint_mode', default='min', enum_values=['min', 'max'], help="Whether lower or higher --checkpoint_metric is better")
+flags.DEFINE_integer('eval_every', default=1, help="Epochs between evaluations on the test split (0 disables them)")
+flags.DEFINE_string('cache_dir', default=None, help="Cache of the split dataset arrays, reused by later runs (default: no cache)")
+flags.DEFINE_float('cache_gb', default=20, help="Size of --cache_dir past which the least recently used entries are removed")
+flags.DEFINE_enum('precision', default='fp32', enum_values=list(POLICIES), help="fp32, or bf16 compute with fp32 params and loss")
 
 
 def get_train_state(model: Seq2seq, params, lr) -> train_state.TrainState:
@@ -70,7 +88,13 @@ def get_train_state(model: Seq2seq, params, lr) -> train_state.TrainState:
 
 
 def binary_cross_entropy_loss(y_pred: Array, y: Array, e=jnp.finfo(jnp.float32).eps) -> float:
-  """Returns cross-entropy loss."""
+  """Returns cross-entropy loss.
+
+  Always computed in float32: in bfloat16, `e` is lost when added to
+  predictions close to 0 or 1.
+  """
+  y_pred = y_pred.astype(jnp.float32)
+  y = y.astype(jnp.float32)
   xe = jnp.sum(-y * jnp.log(y_pred + e) - (1. - y)*jnp.log(1 - y_pred + e), axis=(2,3,4))
   return jnp.mean(xe)
 
@@ -86,26 +110,110 @@ def compute_metrics(y_pred: Array, y: Array) -> Dict[str, float]:
   return metrics
 
 
-@jax.jit
-def train_step(state: train_state.TrainState, X: Array, y: Array, lstm_rng: PRNGKey) -> Tuple[train_state.TrainState, Dict[str, float]]:
-  """Trains one step."""
+def _train_step(state: train_state.TrainState, X: Array, y: Array, lstm_rng: PRNGKey,
+                policy: Policy = POLICIES['fp32'],
+                axis_name: Optional[str] = None) -> Tuple[train_state.TrainState, Dict[str, float]]:
+  """Trains one step.
+
+  The model runs on a copy of the params cast to `policy.compute_dtype`, so
+  gradients flow back to the params in their stored dtype. With `axis_name`,
+  runs on one shard of the batch and averages gradients and metrics over all
+  devices mapped along that axis.
+  """
   lstm_key = jax.random.fold_in(lstm_rng, state.step)
+  if axis_name is not None:
+    lstm_key = jax.random.fold_in(lstm_key, jax.lax.axis_index(axis_name))
 
   def loss_fn(params):
-    preds = state.apply_fn({'params': params},
-                               X,
+    preds = state.apply_fn({'params': policy.cast_to_compute(params)},
+                               policy.cast_to_compute(X),
                                rngs={'lstm': lstm_key})
+    preds = policy.cast_to_output(preds)
     loss = binary_cross_entropy_loss(preds, y)
     return loss, preds
 
   grad_fn = jax.value_and_grad(loss_fn, has_aux=True)
   (_, preds), grads = grad_fn(state.params)
+  if axis_name is not None:
+    grads = jax.lax.pmean(grads, axis_name)
   state = state.apply_gradients(grads=grads)
   metrics = compute_metrics(preds, y)
+  if axis_name is not None:
+    metrics = jax.lax.pmean(metrics, axis_name)
 
   return state, metrics
 
 
+def _train_steps(state: train_state.TrainState, Xs: Array, ys: Array, lstm_rng: PRNGKey,
+                 policy: Policy = POLICIES['fp32'],
+                 axis_name: Optional[str] = None) -> Tuple[train_state.TrainState, Dict[str, float]]:
+  """Trains one step per batch stacked along the leading axis of `Xs` and `ys`.
+
+  Returns the metrics averaged over the block.
+  """
+  def step(state, batch):
+    X, y = batch
+    return _train_step(state, X, y, lstm_rng, policy, axis_name)
+
+  state, metrics = jax.lax.scan(step, state, (Xs, ys))
+  return state, jax.tree_util.tree_map(jnp.mean, metrics)
+
+
+train_step = jax.jit(_train_step, static_argnums=4)
+
+p_train_step = jax.pmap(functools.partial(_train_step, axis_name='devices'),
+                        axis_name='devices', in_axes=(0, 0, 0, None), static_broadcasted_argnums=4)
+
+train_steps = jax.jit(_train_steps, static_argnums=4)
+
+p_train_steps = jax.pmap(functools.partial(_train_steps, axis_name='devices'),
+                         axis_name='devices', in_axes=(0, 0, 0, None), static_broadcasted_argnums=4)
+
+
+def _eval_step(state: train_state.TrainState, X: Array, y: Array, lstm_rng: PRNGKey, thresholds: Array,
+               policy: Policy = POLICIES['fp32'], axis_name: Optional[str] = None) -> Dict[str, Array]:
+  """Returns the contingency counts and summed loss of one test batch."""
+  preds = state.apply_fn({'params': policy.cast_to_compute(state.params)},
+                         policy.cast_to_compute(X),
+                         rngs={'lstm': lstm_rng})
+  preds = policy.cast_to_output(preds)
+  counts = eval_metrics.contingency_counts(preds, y, thresholds)
+  counts['loss'] = binary_cross_entropy_loss(preds, y) * y.shape[1]
+  counts['samples'] = jnp.asarray(y.shape[1], dtype=jnp.float32)
+  if axis_name is not None:
+    counts = jax.lax.psum(counts, axis_name)
+  return counts
+
+
+eval_step = jax.jit(_eval_step, static_argnums=5)
+
+p_eval_step = jax.pmap(functools.partial(_eval_step, axis_name='devices'),
+                       axis_name='devices', in_axes=(0, 0, 0, None, None), static_broadcasted_argnums=5)
+
+
+def evaluate(step_fn, state: train_state.TrainState, batches, lstm_rng: PRNGKey,
+             thresholds=eval_metrics.THRESHOLDS, policy: Policy = POLICIES['fp32']) -> Dict[str, Any]:
+  """Streams over `batches`, accumulating contingency counts on device.
+
+  Only the counts are kept between batches, never the predictions. Returns the
+  CSI/POD/FAR curves per (lead time, threshold) and the mean test loss, or
+  an empty dict when `batches` is empty.
+  """
+  totals = None
+  for X, y in batches:
+    counts = step_fn(state, X, y, lstm_rng, thresholds, policy)
+    totals = counts if totals is None else jax.tree_util.tree_map(jnp.add, totals, counts)
+  if totals is None:
+    return {}
+  totals = jax.device_get(totals)
+  if step_fn is p_eval_step:
+    totals = jax.tree_util.tree_map(lambda x: x[0], totals)
+  results = eval_metrics.scores(totals)
+  results['thresholds'] = thresholds
+  results['loss'] = float(totals['loss'] / totals['samples'])
+  return results
+
+
 def main(_):
   _, architecture_params, _ = drwatson.parse_savename(FLAGS.architecture)
   _, optimiser_params, _ = drwatson.parse_savename(FLAGS.optimiser)
@@ -118,10 +226,19 @@ def main(_):
                   features=architecture_params["features"])
 
 
-  dataset_factory = lambda : get_dataset(N=dataset_params["N"], 
-                                            splitratio=dataset_params["splitratio"],
-                                            batchsize=dataset_params["batchsize"],
-                                            path=dataset_path)
+  devices = jax.local_devices() if FLAGS.multi_device else None
+  cache = ArrayCache(FLAGS.cache_dir, max_bytes=int(FLAGS.cache_gb * 1024**3)) if FLAGS.cache_dir else None
+
+  dataset = SequenceFED(N=dataset_params["N"],
+                        splitratio=dataset_params["splitratio"],
+                        batchsize=dataset_params["batchsize"],
+                        path=dataset_path,
+                        seed=dataset_params.get("seed", 42),
+                        strata=dataset_params.get("strata", 0),
+                        devices=devices,
+                        cache=cache)
+
+  policy = POLICIES[FLAGS.precision]
 
   rng = jax.random.PRNGKey(42)
 
@@ -129,8 +246,9 @@ def main(_):
 
   variables = model.init(
     {'params': rng1, 'lstm': rng2},
-    jnp.ones((dataset_params["N"], 2, 64, 64, 1)),
+    jnp.ones((dataset_params["N"], 2, 64, 64, 1), dtype=policy.compute_dtype),
   )
+  variables = jax.tree_util.tree_map(lambda p: p.astype(policy.param_dtype), variables)
 
   experiment_params = {
     'lr': optimiser_params['lr'],
@@ -154,14 +272,69 @@ def main(_):
 
   state = get_train_state(model, variables['params'], optimiser_params['lr'])
 
+  scan_steps = FLAGS.scan_steps
+  step_fn = train_step if scan_steps == 1 else train_steps
+  eval_fn = eval_step
+  if devices is not None:
+    print(f"training on {len(devices)} devices")
+    state = jax_utils.replicate(state, devices)
+    step_fn = p_train_step if scan_steps == 1 else p_train_steps
+    eval_fn = p_eval_step
+
   print("starting training")
 
+  timer = EpochTimer()
+  checkpointer = AsyncCheckpointer(experiment_dir,
+                                   keep=FLAGS.checkpoint_keep,
+                                   keep_best=FLAGS.checkpoint_keep_best,
+                                   metric=FLAGS.checkpoint_metric,
+                                   mode=FLAGS.checkpoint_mode)
+  if checkpointer.history:
+    # fail now rather than at the first save, after a whole epoch of training
+    raise SystemExit(f"{experiment_dir} already holds checkpoints (steps {sorted(checkpointer.history)}); "
+                     "remove them or change the experiment parameters")
+
   for epoch in range(1, 1+epochs):
     print(f"Epoch {epoch}")
-    train_dataset, test_dataset = dataset_factory()
-    for i, (train_x, train_y) in enumerate(train_dataset):
-      state, metric = train_step(state, train_x, train_y, rng)
+    train_dataset = dataset.train(epoch, prefetch=FLAGS.prefetch, workers=FLAGS.prefetch_workers,
+                                  stack=scan_steps)
+    metric = None
+    for i, (train_x, train_y) in enumerate(timer.iterate('data', train_dataset)):
+      with timer.phase('step'):
+        state, metric = step_fn(state, train_x, train_y, rng, policy)
+    with timer.phase('step'):
+      # steps are dispatched asynchronously, wait for them before reading the clock
+      jax.block_until_ready(state)
+    print(f"Epoch {epoch} timing: {timer.summary()}")
+    if FLAGS.prefetch > 0:
+      print(f"Epoch {epoch} prefetch: {train_dataset.summary()}")
+    timer.reset()
+    if metric is None:
+      # the train split is smaller than one batch: nothing to evaluate or checkpoint
+      print(f"Epoch {epoch}: skipped, the train split yields no batches")
+      continue
+    metric = dict(metric)
+    if FLAGS.eval_every > 0 and epoch % FLAGS.eval_every == 0:
+      results = evaluate(eval_fn, state, dataset.test(prefetch=FLAGS.prefetch, workers=FLAGS.prefetch_workers), rng,
+                         policy=policy)
+      if results:
+        csi = results['csi'].mean(axis=0)
+        best = csi.argmax()
+        print(f"Epoch {epoch} test: loss={results['loss']:.4f}, "
+              f"csi={csi[best]:.4f} (threshold={results['thresholds'][best]:.2f}), "
+              f"csi per lead time={results['csi'][:, best].round(3).tolist()}")
+        metric['test_loss'] = results['loss']
+        metric['test_csi'] = float(csi[best])
+      else:
+        # splitratio=1, or a test split smaller than one batch with --multi_device
+        print(f"Epoch {epoch} test: skipped, the test split yields no batches")
     # writer.write_scalars(epoch, metric)
-    checkpoints.save_checkpoint(experiment_dir, target=state, step=epoch, keep_every_n_steps=1)
+    checkpoint_state = state if devices is None else jax_utils.unreplicate(state)
+    checkpointer.save(checkpoint_state, step=epoch, metrics=metric)
+    print(f"Epoch {epoch} checkpoints: {checkpointer.summary()}")
+
+  checkpointer.close()
+
 
-app.run(main)
\ No newline at end of file
+if __name__ == '__main__':
+  app.run(main)
\ No newline at end of file
@@ -1,17 +1,69 @@
 from netCDF4 import Dataset
 import numpy as np
 
-file = Dataset('dat_new/flash_density_20210101-001500.nc')
-lati = file.variables['latitude'][:]
-loni = file.variables['longitude'][:]
-dd=file.variables['density'][:]
-laa=[];loo=[];densi=[]
-ki=4 #*2km=8km de grilla
-for i in range(0,dd.shape[0]-ki+1,ki):
-    laa.append(np.ma.median(lati[i:i+ki]))
-    ee=[]; loo=[]
-    for j in range(0,dd.shape[1]-ki+1,ki):
-        loo.append(np.ma.median(loni[j:j+ki]))
-        ee.append((np.ma.sum(dd[i:i+ki,j:j+ki])))
-    densi.append(ee)
-deni=np.array(densi) #resultado en grilla 8km
\ No newline at end of file
+
+def _factors(factor):
+    return (factor, factor) if np.isscalar(factor) else tuple(factor)
+
+
+def _pad_to_blocks(a, factors, edge, fill):
+    """Trim (edge='trim') or pad with `fill` (edge='pad') the trailing axes to whole blocks."""
+    a = np.asanyarray(a)
+    axes = range(a.ndim - len(factors), a.ndim)
+    if edge == 'trim':
+        return a[(Ellipsis,) + tuple(slice(0, a.shape[ax] - a.shape[ax] % f) for ax, f in zip(axes, factors))]
+    if edge != 'pad':
+        raise ValueError("edge must be 'trim' or 'pad', got {!r}".format(edge))
+    widths = [(0, 0)] * a.ndim
+    for ax, f in zip(axes, factors):
+        widths[ax] = (0, -a.shape[ax] % f)
+    return np.pad(a, widths, constant_values=fill)
+
+
+def block_sum(a, factor, edge='trim'):
+    """Sum of the factor x factor blocks of the last two axes of a (..., lat, lon) array.
+
+    Any leading axes (e.g. a day of time frames) are carried along, so a whole
+    stack is coarsened with a single reshape + sum. Masked cells are left out
+    of the sums and blocks with no valid cell are masked. With edge='trim' the
+    rows/columns that do not fill a whole block are dropped (as the original
+    loop did); with edge='pad' they form partial blocks at the edges.
+    """
+    fy, fx = _factors(factor)
+    mask = np.ma.getmaskarray(a) if np.ma.isMaskedArray(a) else None
+    data = _pad_to_blocks(np.ma.getdata(a), (fy, fx), edge, 0)
+    if mask is not None:
+        data = np.where(_pad_to_blocks(mask, (fy, fx), edge, True), 0, data)
+    *lead, ny, nx = data.shape
+    shape = (*lead, ny // fy, fy, nx // fx, fx)
+    out = data.reshape(shape).sum(axis=(-3, -1))
+    if mask is None:
+        return out
+    valid = (~_pad_to_blocks(mask, (fy, fx), edge, True)).reshape(shape).any(axis=(-3, -1))
+    return np.ma.masked_array(out, mask=~valid)
+
+
+def block_median(coord, factor, edge='trim'):
+    """Median of every `factor` consecutive values of a 1-D coordinate (the block centers)."""
+    coord = np.ma.masked_invalid(np.ma.asarray(coord, dtype=np.float64))
+    padded = np.ma.masked_array(_pad_to_blocks(coord.filled(np.nan), (factor,), edge, np.nan))
+    blocks = np.ma.masked_invalid(padded).reshape(-1, factor)
+    return np.ma.median(blocks, axis=1)
+
+
+def regrid(density, lat, lon, factor, edge='trim'):
+    """Coarsens a (..., lat, lon) density grid by `factor` (an int or a (lat, lon) pair).
+
+    Returns the block sums of density with the block medians of lat and lon.
+    """
+    fy, fx = _factors(factor)
+    return block_sum(density, (fy, fx), edge), block_median(lat, fy, edge), block_median(lon, fx, edge)
+
+
+if __name__ == '__main__':
+    file = Dataset('dat_new/flash_density_20210101-001500.nc')
+    lati = file.variables['latitude'][:]
+    loni = file.variables['longitude'][:]
+    dd = file.variables['density'][:]
+    ki = 4  # *2km=8km de grilla
+    deni, laa, loo = regrid(dd, lati, loni, ki)  # resultado en grilla 8km
@@ -1,37 +1,315 @@
+import json
 import math
 import h5py
 import os
-import jax.numpy as jnp
+import jax
 import numpy as np
 
+from src.dataset.cache import SplitFED, source_files, split_arrays
+from src.dataset.fed_writer import BITPACKED_ATTR, decode
+from src.dataset.prefetch import Prefetcher
+from src.dataset.sparse import SPARSE_ATTR, SparseFEDFile
+from src.dataset.sampler import SequenceSampler, sample_activity, activity_strata
+
+
+class FEDFile:
+  """Lazy (t, n, w, h, 1) view over the "FED" dataset of a single HDF5 file.
+
+  The file handle stays open and nothing is read until samples are requested,
+  so memory use scales with the number of samples read, not with the file.
+  Bit-packed files (see fed_writer) are unpacked to uint8 as they are read.
+  """
+
+  def __init__(self, path, rdcc_nbytes=64 * 1024**2):
+    self.path = path
+    self.file = h5py.File(path, "r", rdcc_nbytes=rdcc_nbytes)
+    self.fed = self.file["FED"]
+    t,n,_,w,h = self.fed.shape
+    self.packed = BITPACKED_ATTR in self.fed.attrs
+    if self.packed:
+      h = int(self.fed.attrs[BITPACKED_ATTR])
+    self.shape = (t,n,w,h,1)
+    self.dtype = np.dtype(np.uint8) if self.packed else self.fed.dtype
+    # number of samples read together along n; a contiguous dataset can be read
+    # one sample at a time, so its scattered batches never read the span between
+    self.chunk_samples = self.fed.chunks[1] if self.fed.chunks else 1
+
+  def __len__(self):
+    return self.shape[1]
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      start, stop, step = idx.indices(len(self))
+      if step == 1:
+        return self.read(start, stop)
+      idx = np.arange(start, stop, step)
+    return self.take(idx)
+
+  def read(self, start, stop, out=None):
+    """Reads the contiguous samples [start, stop) into `out` (or a new array)."""
+    t,_,w,h,_ = self.shape
+    if out is None:
+      out = np.empty((t, stop-start, w, h, 1), dtype=self.dtype)
+    if self.packed:
+      out[...] = decode(self.fed[:, start:stop], h).reshape(out.shape)
+    elif stop > start:
+      # (t, k, 1, w, h) and (t, k, w, h, 1) share the same memory layout
+      self.fed.read_direct(out.reshape(t, stop-start, 1, w, h),
+                           np.s_[:, start:stop], np.s_[:, :])
+    return out
+
+  def take(self, indices):
+    """Reads the samples at `indices` (in that order) along the n axis.
+
+    Indices spanning about as many chunks as they touch are read with a single
+    slice; scattered ones one sample at a time, which h5py does much faster
+    than a fancy-indexed read of the same samples.
+    """
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    t,_,w,h,_ = self.shape
+    if len(indices) == 0:
+      return np.empty((t, 0, w, h, 1), dtype=self.dtype)
+    unique, inverse = np.unique(indices, return_inverse=True)
+    start, stop = int(unique[0]), int(unique[-1]) + 1
+    if stop - start <= len(unique) + self.chunk_samples:
+      block = self.read(start, stop)
+      positions = (unique - start)[inverse]
+    else:
+      block = np.empty((t, len(unique), w, h, 1), dtype=self.dtype)
+      for j, i in enumerate(unique):
+        sample = self.fed[:, i]
+        block[:, j] = (decode(sample, h) if self.packed else sample).reshape(t, w, h, 1)
+      positions = inverse
+    if block.shape[1] == len(positions) and (positions == np.arange(len(positions))).all():
+      return block
+    return block[:, positions]
+
+  def close(self):
+    self.file.close()
+
+
+INDEX_FILENAME = ".fed_index.json"
+
+
+def scan_header(path):
+  """Shape and dtype of the "FED" dataset of `path`, without reading its data."""
+  with h5py.File(path, "r") as f:
+    if SPARSE_ATTR in f.attrs:
+      t, n, w, h = (int(x) for x in f.attrs[SPARSE_ATTR])
+      return {'shape': [t, n, 1, w, h], 'dtype': f.attrs['dtype']}
+    fed = f["FED"]
+    if BITPACKED_ATTR in fed.attrs:
+      return {'shape': list(fed.shape[:-1]) + [int(fed.attrs[BITPACKED_ATTR])], 'dtype': np.dtype(np.uint8).str}
+    return {'shape': list(fed.shape), 'dtype': fed.dtype.str}
+
+
+def build_index(path):
+  """Per-file FED headers of a folder, persisted next to the data.
+
+  Files are identified by name, size and mtime, so only new or modified files
+  have their headers scanned again.
+  """
+  index_path = os.path.join(path, INDEX_FILENAME)
+  cached = {}
+  if os.path.exists(index_path):
+    with open(index_path) as f:
+      cached = json.load(f)
+  index = {}
+  for name in sorted(os.listdir(path)):
+    if name == INDEX_FILENAME:
+      continue
+    stat = os.stat(os.path.join(path, name))
+    entry = cached.get(name)
+    if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+      entry = {'size': stat.st_size, 'mtime': stat.st_mtime, **scan_header(os.path.join(path, name))}
+    index[name] = entry
+  if index != cached:
+    try:
+      with open(index_path, "w") as f:
+        json.dump(index, f)
+    except OSError:
+      pass
+  return index
+
+
+class FEDFolder:
+  """Lazy concatenation along n of every FED file in a folder.
+
+  Global sample ids are mapped to (file, local index) through the cumulative
+  sample offsets of the folder index; files are opened on first access.
+  """
+
+  def __init__(self, path):
+    index = build_index(path)
+    self.paths = [os.path.join(path, name) for name in index]
+    self.files = [None] * len(self.paths)
+    counts = [entry['shape'][1] for entry in index.values()]
+    self.offsets = np.cumsum([0] + counts)
+    t,_,_,w,h = next(iter(index.values()))['shape']
+    self.shape = (t, int(self.offsets[-1]), w, h, 1)
+    self.dtype = np.dtype(next(iter(index.values()))['dtype'])
+
+  def __len__(self):
+    return self.shape[1]
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      idx = np.arange(*idx.indices(len(self)))
+    return self.take(idx)
+
+  def file(self, i):
+    if self.files[i] is None:
+      self.files[i] = open_file(self.paths[i])
+    return self.files[i]
+
+  def locate(self, indices):
+    """Maps global sample ids to (file number, index inside that file)."""
+    file_idx = np.searchsorted(self.offsets, indices, side="right") - 1
+    return file_idx, indices - self.offsets[file_idx]
+
+  def read(self, start, stop):
+    return self.take(np.arange(start, stop))
+
+  def take(self, indices):
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    t,_,w,h,c = self.shape
+    file_idx, local_idx = self.locate(indices)
+    if len(indices) > 0 and (file_idx == file_idx[0]).all():
+      return self.file(file_idx[0]).take(local_idx)
+    out = np.empty((t, len(indices), w, h, c), dtype=self.dtype)
+    for i in np.unique(file_idx):
+      mask = file_idx == i
+      out[:, mask] = self.file(i).take(local_idx[mask])
+    return out
+
+  def close(self):
+    for f in self.files:
+      if f is not None:
+        f.close()
+
+
+def open_file(path):
+  """FEDFile of a dense file, or the in-memory SparseFEDFile of a sparse one."""
+  with h5py.File(path, "r") as f:
+    sparse = SPARSE_ATTR in f.attrs
+  return SparseFEDFile(path) if sparse else FEDFile(path)
+
+
+def open_dataset(path):
+  """Opens a file or folder of FED files lazily."""
+  assert os.path.exists(path)
+  if os.path.isdir(path):
+    return FEDFolder(path)
+  return open_file(path)
+
+
 def read_from_file(path):
   f = h5py.File(path, "r")
+  if SPARSE_ATTR in f.attrs:
+    f.close()
+    sparse = SparseFEDFile(path)
+    return sparse.read(0, len(sparse))
   arr = f["FED"][:]
+  if BITPACKED_ATTR in f["FED"].attrs:
+    arr = decode(arr, int(f["FED"].attrs[BITPACKED_ATTR]))
   t,n,_,w,h = arr.shape
   return arr.reshape(t,n,w,h,1).copy()
 
 def read_from_folder(path):
-  paths = [os.path.join(path, x) for x in os.listdir(path)]
+  paths = [os.path.join(path, x) for x in os.listdir(path) if x != INDEX_FILENAME]
   datasets = [read_from_file(p) for p in paths]
   return np.concatenate(datasets, axis=1)
 
 
-def get_dataset(splitratio, batchsize, N, path):
-  assert os.path.exists(path)
-  if os.path.isdir(path):
-    dataset = read_from_folder(path)
-  elif os.path.isfile(path):
-    dataset = read_from_file(path)
-  TOTAL_SAMPLES = dataset.shape[1]
-  N_TRAIN = math.ceil(TOTAL_SAMPLES * splitratio)
-  N_TEST = TOTAL_SAMPLES - N_TRAIN
-  dataset_train = dataset[:, :N_TRAIN]
-  dataset_test = dataset[:, N_TRAIN+1:]
-  x_train = (jnp.array(dataset_train[:N, t:t+batchsize]) for t in range(0, N_TRAIN-batchsize+1, batchsize))
-  y_train = (jnp.array(dataset_train[N:, t:t+batchsize]) for t in range(0, N_TRAIN-batchsize+1, batchsize))
-  train_data = zip(x_train, y_train)
-  x_test = (jnp.array(dataset_test[:N, t:t+batchsize]) for t in range(0, N_TEST-batchsize+1, batchsize))
-  y_test = (jnp.array(dataset_test[N:, t:t+batchsize]) for t in range(0, N_TEST-batchsize+1, batchsize))
-  test_data = zip(x_test, y_test)
-  return (train_data, test_data)
+def shard(arr, n, axis=1):
+  """Splits the sample `axis` of a batch into n equal shards stacked on a new leading axis."""
+  b = arr.shape[axis]
+  arr = arr.reshape(*arr.shape[:axis], n, b // n, *arr.shape[axis+1:])
+  return np.moveaxis(arr, axis, 0)
 
+
+class SequenceFED:
+  """Train/test split of a FED dataset that can be iterated once per epoch.
+
+  The file is opened and split a single time; every call to `train` only draws
+  a new sample order from the sampler, so starting an epoch costs no I/O.
+  `strata` > 0 balances batches across that many bins of storm activity.
+  With `devices`, every batch is split along the sample axis into one
+  (t, batchsize/len(devices), w, h, 1) shard per device, ready for `jax.pmap`.
+  With a `cache` (src/dataset/cache.py ArrayCache), the split is read once into
+  memory-mapped `dtype` arrays that later runs on the same files reuse.
+  With `stack` > 1, that many consecutive batches are stacked on a new leading
+  axis (after the device axis) so a block of steps can run inside one `lax.scan`.
+  """
+
+  def __init__(self, splitratio, batchsize, N, path, seed=42, shuffle=True, strata=0, devices=None,
+               cache=None, dtype=np.float32):
+    self.dataset = open_dataset(path)
+    if cache is not None:
+      n_train = math.ceil(self.dataset.shape[1] * splitratio)
+      params = dict(type='SequenceFED', splitratio=splitratio, dtype=np.dtype(dtype).name)
+      arrays = cache.get(params, source_files(path), split_arrays(self.dataset, n_train, dtype))
+      self.dataset.close()
+      self.dataset = SplitFED(arrays['train'], arrays['test'])
+    self.batchsize = batchsize
+    self.N = N
+    self.devices = devices
+    if devices is not None:
+      assert batchsize % len(devices) == 0, f"batchsize {batchsize} is not divisible by {len(devices)} devices"
+      mesh = jax.sharding.Mesh(np.asarray(devices), ('devices',))
+      self.sharding = jax.sharding.NamedSharding(mesh, jax.sharding.PartitionSpec('devices'))
+    TOTAL_SAMPLES = self.dataset.shape[1]
+    N_TRAIN = math.ceil(TOTAL_SAMPLES * splitratio)
+    train_idx = np.arange(0, N_TRAIN)
+    train_strata = None
+    if shuffle and strata > 0:
+      activity = sample_activity(self.dataset)[:N_TRAIN]
+      train_strata = activity_strata(activity, strata)
+    # the tail batch is dropped so train_step keeps a single compiled shape;
+    # with shuffling a different tail is left out every epoch
+    self.train_sampler = SequenceSampler(train_idx, batchsize, shuffle=shuffle, seed=seed,
+                                         strata=train_strata, drop_last=True)
+    self.test_sampler = SequenceSampler(np.arange(N_TRAIN, TOTAL_SAMPLES), batchsize, shuffle=False,
+                                        drop_last=devices is not None)
+
+  def __len__(self):
+    return len(self.train_sampler)
+
+  def load(self, indices):
+    """Reads the (x, y) host arrays of the batch made of samples `indices`."""
+    batch = self.dataset.take(indices)
+    return batch[:self.N], batch[self.N:]
+
+  def load_block(self, block):
+    """Reads a list of batches and stacks their x and y on a new leading axis."""
+    batches = [self.load(indices) for indices in block]
+    return tuple(np.stack(arrs) for arrs in zip(*batches))
+
+  def place(self, batch, axis=1):
+    """Copies a host batch to the device, or shards its sample `axis` over `devices`."""
+    if self.devices is None:
+      return jax.device_put(batch)
+    return tuple(jax.device_put(shard(arr, len(self.devices), axis), self.sharding) for arr in batch)
+
+  def batches(self, batch_indices, prefetch=0, workers=1, stack=1):
+    """Yields device (x, y) batches, reading `prefetch` batches ahead if > 0."""
+    if stack > 1:
+      batch_indices = [batch_indices[i:i+stack] for i in range(0, len(batch_indices), stack)]
+      load = lambda block: self.place(self.load_block(block), axis=2)
+    else:
+      load = lambda idx: self.place(self.load(idx))
+    if prefetch > 0:
+      return Prefetcher(load, batch_indices, depth=prefetch, workers=workers)
+    return (load(idx) for idx in batch_indices)
+
+  def train(self, epoch=0, **kwargs):
+    """Yields the (x, y) training batches of `epoch`."""
+    return self.batches(self.train_sampler.batches(epoch), **kwargs)
+
+  def test(self, **kwargs):
+    return self.batches(self.test_sampler.batches(), **kwargs)
+
+
+def get_dataset(splitratio, batchsize, N, path):
+  dataset = SequenceFED(splitratio, batchsize, N, path)
+  return (dataset.train(), dataset.test())
@@ -0,0 +1,168 @@
+"""On-disk cache of the arrays SequenceFED trains on.
+
+Every entry is a folder of .npy files named after the drwatson savename of
+the parameters that produced them plus a fingerprint of the source files
+(path, size and mtime, or their contents with `content_hash`), so editing or
+replacing a dataset file never hits a stale entry. Arrays are returned
+memory-mapped with `np.load(mmap_mode='r')`: opening an entry costs nothing
+and only the pages of the sampled windows are read. The least recently used
+entries are evicted once the cache grows past `max_bytes`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from src.utils import drwatson
+
+META_FILENAME = 'meta.json'
+
+
+def source_files(path):
+  """The files behind a FED file or folder, sorted."""
+  if os.path.isdir(path):
+    return sorted(os.path.join(path, x) for x in os.listdir(path) if not x.startswith('.'))
+  return [path]
+
+
+def fingerprint(paths, content_hash=False, digits=12):
+  """Short hash of the path, size and mtime (or contents) of every file in `paths`."""
+  h = hashlib.sha1()
+  for path in paths:
+    stat = os.stat(path)
+    h.update(f"{os.path.abspath(path)}:{stat.st_size}".encode())
+    if content_hash:
+      with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+          h.update(block)
+    else:
+      h.update(f":{stat.st_mtime_ns}".encode())
+  return h.hexdigest()[:digits]
+
+
+class ArrayCache:
+  """Folder of cached entries, each a dict of named arrays."""
+
+  def __init__(self, root=None, max_bytes=20 * 1024**3, content_hash=False):
+    self.root = root or drwatson.datadir('cache')
+    self.max_bytes = max_bytes
+    self.content_hash = content_hash
+    os.makedirs(self.root, exist_ok=True)
+
+  def key(self, params, sources):
+    params = dict(params, src=fingerprint(sources, self.content_hash))
+    return drwatson.savename(params)
+
+  def entries(self):
+    """(last used, bytes, path) of every complete entry."""
+    result = []
+    for name in os.listdir(self.root):
+      path = os.path.join(self.root, name)
+      if name.startswith('.') or not os.path.exists(os.path.join(path, META_FILENAME)):
+        continue
+      size = sum(os.path.getsize(os.path.join(path, x)) for x in os.listdir(path))
+      result.append((os.path.getmtime(path), size, path))
+    return result
+
+  def load(self, path):
+    with open(os.path.join(path, META_FILENAME)) as f:
+      names = json.load(f)['arrays']
+    # the folder mtime records the last use, for eviction
+    os.utime(path)
+    return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in names}
+
+  def get(self, params, sources, build):
+    """Arrays of the entry of `params` and `sources`, created with `build` if missing.
+
+    `build(dir)` writes the arrays as dir/<name>.npy (np.save or
+    np.lib.format.open_memmap) and returns their names.
+    """
+    path = os.path.join(self.root, self.key(params, sources))
+    if os.path.exists(os.path.join(path, META_FILENAME)):
+      return self.load(path)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+    try:
+      names = build(tmp)
+      with open(os.path.join(tmp, META_FILENAME), 'w') as f:
+        json.dump({'arrays': list(names), 'params': params, 'sources': sources, 'created': time.time()}, f)
+      try:
+        os.replace(tmp, path)
+      except OSError:
+        # another process created the same entry first
+        pass
+    finally:
+      if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    self.evict(keep=path)
+    return self.load(path)
+
+  def evict(self, keep=None):
+    """Removes the least recently used entries until the cache fits in `max_bytes`."""
+    entries = sorted(self.entries())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+      if total <= self.max_bytes:
+        break
+      if path == keep:
+        continue
+      shutil.rmtree(path, ignore_errors=True)
+      total -= size
+    return total
+
+
+def split_arrays(dataset, n_train, dtype=np.float32, block_samples=256):
+  """`build` function of the train/test split of a FED dataset, converted to `dtype`.
+
+  Writes train.npy and test.npy, the (t, n, w, h, 1) windows before and after
+  `n_train`, a block of samples at a time.
+  """
+  def build(folder):
+    t, n, w, h, c = dataset.shape
+    for name, start, stop in (('train', 0, n_train), ('test', n_train, n)):
+      out = np.lib.format.open_memmap(os.path.join(folder, name + '.npy'), mode='w+',
+                                      dtype=dtype, shape=(t, stop - start, w, h, c))
+      for i in range(start, stop, block_samples):
+        j = min(i + block_samples, stop)
+        out[:, i-start:j-start] = dataset.read(i, j)
+      out.flush()
+      del out
+    return ['train', 'test']
+  return build
+
+
+class SplitFED:
+  """Cached train and test arrays seen as one FED dataset, train samples first."""
+
+  def __init__(self, train, test):
+    self.train, self.test = train, test
+    t, _, w, h, c = train.shape
+    self.shape = (t, train.shape[1] + test.shape[1], w, h, c)
+    self.dtype = train.dtype
+
+  def __len__(self):
+    return self.shape[1]
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      idx = np.arange(*idx.indices(len(self)))
+    return self.take(idx)
+
+  def read(self, start, stop):
+    return self.take(np.arange(start, stop))
+
+  def take(self, indices):
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    n_train = self.train.shape[1]
+    out = np.empty((self.shape[0], len(indices)) + self.shape[2:], dtype=self.dtype)
+    is_train = indices < n_train
+    out[:, is_train] = self.train[:, indices[is_train]]
+    out[:, ~is_train] = self.test[:, indices[~is_train] - n_train]
+    return out
+
+  def close(self):
+    pass
@@ -0,0 +1,147 @@
+"""Storm clusters of a FED cube and the fixed-size windows around them.
+
+Python port of cluster_dbscan.jl. Arrays here are (time, lat, lon), so every
+per-dimension tuple (dimensions, windows, padding) is given in that order,
+while the Julia code and the cluster_dataset parameters use (lon, lat, time).
+Indices are 0-based and bounding boxes are inclusive, as in the Julia code.
+"""
+
+from itertools import product
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+
+def dbscan(points, radius, min_neighbors, min_cluster_size):
+  """DBSCAN over the rows of `points`, with the semantics of Clustering.dbscan.
+
+  A point is core when at least `min_neighbors` points (itself included) lie
+  within `radius`. Core points within `radius` of each other share a cluster,
+  every other point within `radius` of a core point joins the cluster of its
+  lowest-index core neighbor, and clusters smaller than `min_cluster_size` are
+  dropped. Neighbors come from a KD-tree, so the cost grows with the number of
+  points times their neighbors instead of with the number of points squared.
+  Returns a list of index arrays into `points`.
+  """
+  n = len(points)
+  if n == 0:
+    return []
+  pairs = cKDTree(points).query_pairs(radius, output_type="ndarray")
+  counts = np.bincount(pairs.ravel(), minlength=n) + 1
+  core = counts >= min_neighbors
+
+  core_pairs = pairs[core[pairs[:, 0]] & core[pairs[:, 1]]]
+  graph = coo_matrix((np.ones(len(core_pairs), dtype=np.int8), (core_pairs[:, 0], core_pairs[:, 1])), shape=(n, n))
+  _, labels = connected_components(graph, directed=False)
+  labels[~core] = -1
+
+  # boundary points take the label of their lowest-index core neighbor
+  border = pairs[core[pairs[:, 0]] != core[pairs[:, 1]]]
+  seed = np.where(core[border[:, 0]], border[:, 0], border[:, 1])
+  point = np.where(core[border[:, 0]], border[:, 1], border[:, 0])
+  order = np.lexsort((seed, point))
+  point, seed = point[order], seed[order]
+  first = np.unique(point, return_index=True)[1]
+  labels[point[first]] = labels[seed[first]]
+
+  members = np.flatnonzero(labels >= 0)
+  members = members[np.argsort(labels[members], kind="stable")]
+  clusters = np.split(members, np.flatnonzero(np.diff(labels[members])) + 1)
+  return [c for c in clusters if len(c) >= min_cluster_size]
+
+
+def climarr_cluster(arr, radius, min_neighbors, min_cluster_size, t_scale=1, threshold=1):
+  """Clusters of the voxels of a (time, lat, lon) cube that reach `threshold`.
+
+  Time is treated as a third spatial axis scaled by `t_scale`. Returns one
+  (k, 3) array of voxel indices per cluster.
+  """
+  found = np.argwhere(arr >= threshold)
+  points = found.astype(np.float32)
+  points[:, 0] *= t_scale
+  return [found[c] for c in dbscan(points, radius, min_neighbors, min_cluster_size)]
+
+
+def bbox(cluster, padding=(0, 0, 0)):
+  """Inclusive (lower, upper) bounds of a cluster along each axis, widened by `padding`."""
+  lower, upper = cluster.min(axis=0), cluster.max(axis=0)
+  return tuple((int(lo - p), int(up + p)) for lo, up, p in zip(lower, upper, padding))
+
+
+def expand_bbox(box, min_dims, limits):
+  """Grows a bounding box to at least `min_dims` along each axis, staying inside [0, limits)."""
+  expanded = []
+  for (lower, upper), dim, limit in zip(box, min_dims, limits):
+    last = limit - 1
+    lower = max(lower, 0)
+    upper = min(upper, last)
+    extent = upper - lower
+    if lower - (dim - extent) // 2 < 0:
+      lower = 0
+      upper = lower + dim
+    elif upper + (dim - extent) // 2 > last:
+      upper = last
+      lower = upper - dim
+    extent = upper - lower
+    if extent < dim:
+      lower -= (dim - extent) // 2
+      if lower < 0:
+        lower = 0
+      upper += dim - upper + lower
+      if upper > last:
+        upper = last
+        lower = upper - dim
+    expanded.append((lower, upper))
+  return tuple(expanded)
+
+
+def window_slices(box, dimensions, windows):
+  """Slices of the `dimensions`-sized windows inside a box, moved `windows` cells at a time.
+
+  An axis with a window of 0 only gets the window starting at the box's lower bound.
+  """
+  starts = []
+  for (lower, upper), dim, step in zip(box, dimensions, windows):
+    starts.append([lower] if step == 0 else range(lower, upper - dim + 1, step))
+  for start in product(*starts):
+    yield tuple(slice(s, s + dim) for s, dim in zip(start, dimensions))
+
+
+def moving_window(arr, clusters, dimensions, windows, padding):
+  """Slices of every window around every cluster of a (time, lat, lon) cube."""
+  for size, dim in zip(arr.shape, dimensions):
+    assert size >= dim, f"cube of shape {arr.shape} is smaller than the windows {dimensions}"
+  boxes = [expand_bbox(bbox(c, padding), dimensions, arr.shape) for c in clusters]
+  return [s for box in boxes for s in window_slices(box, dimensions, windows)]
+
+
+def generate_dataset(arr, time, lat, lon, dimensions, radius, min_neighbors, min_cluster_size,
+                     t_scale=1, windows=(0, 0, 0), threshold=1, padding=(0, 0, 0)):
+  """Windows around the storm clusters of a (time, lat, lon) cube, as `generate_dataset` in Julia.
+
+  Returns a dict in the layout of the HDF5 files read by SequenceFED:
+  "FED" (T, N, 1, lat, lon), "lat" (N, lat), "lon" (N, lon) and "time" (N, T)
+  in seconds since the unix epoch.
+  """
+  clusters = climarr_cluster(arr, radius, min_neighbors, min_cluster_size, t_scale, threshold)
+  windows = [s for s in moving_window(arr, clusters, dimensions, windows, padding)
+             if arr[s].sum() > min_cluster_size]
+  return windows_to_plain(arr, time, lat, lon, windows, dimensions)
+
+
+def windows_to_plain(arr, time, lat, lon, windows, dimensions):
+  """Stacks the window slices of a cube into the dict written by cluster_grid."""
+  t, h, w = dimensions
+  fed = np.empty((t, len(windows), 1, h, w), dtype=arr.dtype)
+  out_lat = np.empty((len(windows), h), dtype=np.float32)
+  out_lon = np.empty((len(windows), w), dtype=np.float32)
+  out_time = np.empty((len(windows), t), dtype=np.float64)
+  seconds = (np.asarray(time, dtype="datetime64[s]") - np.datetime64(0, "s")).astype(np.float64)
+  for i, (st, sy, sx) in enumerate(windows):
+    fed[:, i, 0] = arr[st, sy, sx]
+    out_lat[i] = lat[sy]
+    out_lon[i] = lon[sx]
+    out_time[i] = seconds[st]
+  return {"FED": fed, "lat": out_lat, "lon": out_lon, "time": out_time}
@@ -0,0 +1,184 @@
+"""Incremental storm clustering: only newly arrived FED frames are clustered again.
+
+`IncrementalClusterer` keeps the trailing frames of the cube that can still
+change a cluster (those of clusters touching the last frame, plus enough
+frames before them for DBSCAN neighbors and window expansion). Every update
+clusters that buffer together with the new frames, emits the windows of the
+clusters that can no longer grow, and appends them to the dataset file. The
+KD-tree is rebuilt from the buffer on each update, which is cheap next to
+reading a year of grids. The state is saved with `save`/`load` as .npz.
+
+Windows are the same as those of a full run of `generate_dataset` over the
+whole cube, but they are appended in the order the clusters close.
+"""
+
+import json
+import math
+import os
+
+import h5py
+import numpy as np
+
+from src.dataset.cluster_dbscan import climarr_cluster, bbox, expand_bbox, window_slices, windows_to_plain
+
+
+class IncrementalClusterer:
+
+  def __init__(self, dimensions, radius, min_neighbors, min_cluster_size,
+               t_scale=1, windows=(0, 0, 0), threshold=1, padding=(0, 0, 0)):
+    self.params = dict(dimensions=tuple(dimensions), radius=radius, min_neighbors=min_neighbors,
+                       min_cluster_size=min_cluster_size, t_scale=t_scale, windows=tuple(windows),
+                       threshold=threshold, padding=tuple(padding))
+    # frames after which a voxel can no longer get a DBSCAN neighbor
+    self.reach = int(math.floor(radius / t_scale))
+    # frames a window can extend past the cluster it was cut around
+    self.extent = self.params["padding"][0] + self.params["dimensions"][0]
+    # frames kept before the earliest open cluster; clusters starting in them are
+    # left-overs of clusters closed by an earlier update
+    self.margin = 2 * self.reach + self.extent
+    self.buffer = None  # (t, lat, lon) trailing frames
+    self.time = None
+    self.start = 0      # global index of the first buffered frame
+    self.emitted = np.empty((0, 3), dtype=np.int64)  # global first voxel of the emitted clusters
+    self.lat = self.lon = None
+
+  @property
+  def end(self):
+    """Global index one past the last frame seen."""
+    return self.start + (0 if self.buffer is None else len(self.buffer))
+
+  def update(self, frames, time, lat, lon, final=False):
+    """Adds (t, lat, lon) frames; returns the windows of the clusters closed by them.
+
+    Frames already seen (by time) are skipped. With `final`, the cube is taken
+    to end here and every remaining cluster is closed.
+    """
+    time = np.asarray(time, dtype="datetime64[s]")
+    if self.buffer is None:
+      self.buffer, self.time, self.lat, self.lon = frames[:0], time[:0], lat, lon
+    elif self.buffer.shape[1:] != frames.shape[1:]:
+      raise ValueError(f"frames of shape {frames.shape[1:]} do not match the buffered {self.buffer.shape[1:]}")
+    if len(self.time) > 0:
+      new = time > self.time[-1]
+      frames, time = frames[new], time[new]
+    self.buffer = np.concatenate([self.buffer, frames])
+    self.time = np.concatenate([self.time, time])
+    return self._cluster(final)
+
+  def _cluster(self, final):
+    p = self.params
+    dims, windows = p["dimensions"], p["windows"]
+    # small clusters are kept too: new frames can still grow them past min_cluster_size
+    clusters = climarr_cluster(self.buffer, p["radius"], p["min_neighbors"], 1, p["t_scale"], p["threshold"])
+    last = len(self.buffer) - 1
+    emitted = set(map(tuple, self.emitted))
+    slices, keys, open_starts = [], [], []
+    for cluster in clusters:
+      t_min, t_max = cluster[0, 0], cluster[-1, 0]
+      if self.start > 0 and t_min < self.margin:
+        continue
+      # a voxel of the new frames can make a buffered voxel within `reach` core,
+      # which links clusters up to 2 * reach frames back
+      if not final and t_max + max(2 * self.reach, self.extent) >= last:
+        open_starts.append(t_min)
+        continue
+      key = tuple(cluster[0] + (self.start, 0, 0))
+      if len(cluster) < p["min_cluster_size"] or key in emitted:
+        continue
+      box = expand_bbox(bbox(cluster, p["padding"]), dims, self.buffer.shape)
+      slices.extend(s for s in window_slices(box, dims, windows) if self.buffer[s].sum() > p["min_cluster_size"])
+      keys.append(key)
+
+    dataset = windows_to_plain(self.buffer, self.time, self.lat, self.lon, slices, dims)
+    if keys:
+      self.emitted = np.concatenate([self.emitted, np.array(keys, dtype=np.int64)])
+    self._trim(open_starts, len(self.buffer) if final else None)
+    return dataset
+
+  def _trim(self, open_starts, keep_from=None):
+    """Drops the buffered frames no open cluster can reach any more."""
+    if keep_from is None:
+      # noise voxels up to 2 * reach frames back can still join a new cluster
+      keep_from = min(open_starts + [len(self.buffer) - 1 - 2 * self.reach]) - self.margin
+    keep_from = max(keep_from, 0)
+    self.buffer, self.time = self.buffer[keep_from:], self.time[keep_from:]
+    self.start += keep_from
+    # clusters starting before the margin are skipped anyway, but only once
+    # frames have been dropped (same condition as in `_cluster`)
+    if self.start > 0:
+      self.emitted = self.emitted[self.emitted[:, 0] >= self.start + self.margin]
+
+  def save(self, path):
+    # through a file handle: np.savez would add ".npz" to any other path name
+    with open(path, "wb") as f:
+      np.savez(f, buffer=self.buffer, time=self.time, lat=self.lat, lon=self.lon,
+               start=self.start, emitted=self.emitted, params=json.dumps(self.params))
+
+  @classmethod
+  def load(cls, path):
+    state = np.load(path)
+    params = json.loads(str(state["params"]))
+    clusterer = cls(**params)
+    clusterer.buffer, clusterer.time = state["buffer"], state["time"]
+    clusterer.lat, clusterer.lon = state["lat"], state["lon"]
+    clusterer.start, clusterer.emitted = int(state["start"]), state["emitted"]
+    return clusterer
+
+
+def sample_axis(key):
+  return 1 if key == "FED" else 0
+
+
+def create_resizable(f, key, val, compression=1):
+  """Creates a dataset of the cluster_grid layout with an unlimited, one-sample-per-chunk sample axis."""
+  axis = sample_axis(key)
+  maxshape = list(val.shape)
+  maxshape[axis] = None
+  chunks = [max(1, x) for x in val.shape]
+  chunks[axis] = 1
+  return f.create_dataset(key, data=val, maxshape=tuple(maxshape), chunks=tuple(chunks),
+                          compression="gzip" if compression > 0 else None,
+                          compression_opts=compression if compression > 0 else None)
+
+
+def is_resizable(path):
+  with h5py.File(path, "r") as f:
+    return all(f[key].maxshape[sample_axis(key)] is None for key in f)
+
+
+def append_target(path):
+  """`path`, or the first <name>_<k>.h5 next to it that is missing or resizable if `path` is not."""
+  root, ext = os.path.splitext(path)
+  candidate, k = path, 0
+  while os.path.exists(candidate) and not is_resizable(candidate):
+    k += 1
+    candidate = f"{root}_{k}{ext}"
+  return candidate
+
+
+def append_windows(path, dataset, compression=1):
+  """Appends windows along the sample axis of a dataset file, creating it if needed.
+
+  The file uses the layout of cluster_grid ("FED" (T, N, 1, lat, lon) and the
+  (N, k) lat/lon/time matrices), with the sample axis left unlimited. Files
+  with a fixed sample axis (written by cluster_grid.jl or older versions of
+  cluster_grid.py) are left untouched and the windows go to a resizable
+  <name>_<k>.h5 next to them, which SequenceFED reads together with them
+  when given the folder.
+  Returns the path written to.
+  """
+  path = append_target(path)
+  n = dataset["FED"].shape[1]
+  with h5py.File(path, "a") as f:
+    for key, val in dataset.items():
+      if key not in f:
+        create_resizable(f, key, val, compression)
+        continue
+      axis = sample_axis(key)
+      ds = f[key]
+      old = ds.shape[axis]
+      ds.resize(old + n, axis=axis)
+      index = [slice(None)] * ds.ndim
+      index[axis] = slice(old, old + n)
+      ds[tuple(index)] = val
+  return path
@@ -0,0 +1,162 @@
+"""Flash extent density (FED) grids from GLM L2 LCFA files, in NumPy.
+
+Python counterpart of `generate_climarray` in fed_grid.jl: flashes are binned
+into a regular (time, lat, lon) cube of flash counts over the Peruvian domain
+with a single `np.bincount`, instead of going through glmtools' per-event
+polygon clipping.
+"""
+
+import numpy as np
+import h5py
+from netCDF4 import Dataset, num2date
+
+# measures taken from https://es.wikipedia.org/wiki/Geograf%C3%ADa_del_Per%C3%BA#Puntos_extremos
+PERU_N = -3 / 100
+PERU_S = -16517 / 900
+PERU_E = -27463 / 400
+PERU_W = -11711 / 144
+
+KM_PER_LAT_DEGREE = 110.54
+KM_PER_LON_DEGREE = 111.32  # at the equator, times cos(lat)
+
+
+def gridrange(resolution, N=PERU_N, S=PERU_S, E=PERU_E, W=PERU_W):
+  """(lon_edges, lat_edges) of a `resolution` km grid, as computed by fed_grid.jl."""
+  lat_step = resolution / KM_PER_LAT_DEGREE
+  lat_edges = np.arange(S, N + lat_step * 1e-3, lat_step)
+  lon_step = np.mean(resolution / (KM_PER_LON_DEGREE * np.cos(np.deg2rad(lat_edges))))
+  lon_edges = np.arange(W, E + lon_step * 1e-3, lon_step)
+  return lon_edges.astype(np.float32), lat_edges.astype(np.float32)
+
+
+def _time_base(units):
+  """Reference datetime64 of a CF 'seconds since ...' units string."""
+  unit, _, base = units.partition(" since ")
+  assert unit.strip() == "seconds", f"unsupported time units {units!r}"
+  base = base.strip().rstrip("Z").replace(" ", "T")
+  return np.datetime64(base, "ms")
+
+
+def read_flashes(path):
+  """(lat, lon, time) of every flash of a LCFA file; time is datetime64[ms] of its first event."""
+  with Dataset(path, "r") as ds:
+    lat = ds["flash_lat"][:].astype(np.float32).filled(np.nan)
+    lon = ds["flash_lon"][:].astype(np.float32).filled(np.nan)
+    offset = ds["flash_time_offset_of_first_event"]
+    seconds = np.ma.filled(offset[:].astype(np.float64), np.nan)
+    base = _time_base(offset.units)
+  valid = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(seconds)
+  time = base + np.round(seconds[valid] * 1000).astype("timedelta64[ms]")
+  return lat[valid], lon[valid], time
+
+
+def read_files(paths):
+  """Concatenated (lat, lon, time) of the flashes of several LCFA files."""
+  flashes = [read_flashes(p) for p in paths]
+  return tuple(np.concatenate(arrs) for arrs in zip(*flashes))
+
+
+def time_edges(time, temporal, start=None, stop=None):
+  """Edges of `temporal` minute bins covering `time`, or [start, stop) when given."""
+  step = np.timedelta64(int(temporal), "m")
+  if start is None:
+    start = time.min().astype("datetime64[m]")
+    start = start - (start - np.datetime64(0, "m")) % step
+  start = np.datetime64(start, "ms")
+  stop = time.max() + np.timedelta64(1, "ms") if stop is None else np.datetime64(stop, "ms")
+  frames = max(-((start - stop) // step), 0)  # ceil((stop - start) / step)
+  return start + step * np.arange(frames + 1)
+
+
+def bin_index(x, edges):
+  """Index of the [edges[i], edges[i+1]) bin holding each x; -1 or len(edges)-1 outside.
+
+  Same result as `np.searchsorted(edges, x, "right") - 1` for regular edges,
+  but computed from the step with a one-bin correction for rounding.
+  """
+  n = len(edges) - 1
+  i = np.floor((x - edges[0]) * (n / (edges[-1] - edges[0]))).astype(np.int64)
+  np.clip(i, -1, n, out=i)
+  i -= (i >= 0) & (x < edges[np.clip(i, 0, n)])
+  i += (i < n) & (x >= edges[np.clip(i + 1, 0, n)])
+  return i
+
+
+def grid_flashes(lat, lon, time, spatial=8, temporal=5, N=PERU_N, S=PERU_S, E=PERU_E, W=PERU_W,
+                 start=None, stop=None, dtype=np.float32):
+  """Counts flashes into a (time, lat, lon) FED cube.
+
+  `spatial` is the cell size in km and `temporal` the frame length in minutes.
+  Bins are closed on the left like a Julia `Histogram`; flashes outside the
+  grid or outside the frames covering [start, stop) are dropped. Returns the
+  cube with its time, lat and lon edges.
+  """
+  lon_edges, lat_edges = gridrange(spatial, N, S, E, W)
+  t_edges = time_edges(time, temporal, start, stop)
+  shape = (len(t_edges) - 1, len(lat_edges) - 1, len(lon_edges) - 1)
+
+  step = np.timedelta64(int(temporal), "m")
+  ti = (time.astype("datetime64[ms]") - t_edges[0]) // step
+  yi = bin_index(lat, lat_edges)
+  xi = bin_index(lon, lon_edges)
+  inside = ((ti >= 0) & (ti < shape[0]) & (yi >= 0) & (yi < shape[1]) & (xi >= 0) & (xi < shape[2]))
+
+  flat = np.ravel_multi_index((ti[inside], yi[inside], xi[inside]), shape)
+  fed = np.bincount(flat, minlength=np.prod(shape)).reshape(shape).astype(dtype)
+  return fed, t_edges, lat_edges, lon_edges
+
+
+def grid_files(paths, spatial=8, temporal=5, **kwargs):
+  """FED cube of all the flashes in `paths`; see `grid_flashes`."""
+  lat, lon, time = read_files(paths)
+  return grid_flashes(lat, lon, time, spatial, temporal, **kwargs)
+
+
+def write_fed(path, fed, t_edges, lat_edges, lon_edges, spatial, temporal, deflatelevel=1, attrs=None):
+  """Writes a FED cube as NetCDF with the dimensions and attributes of `ncwrite_compressed`."""
+  with Dataset(path, "w") as ds:
+    ds.createDimension("time", fed.shape[0])
+    ds.createDimension("lat", fed.shape[1])
+    ds.createDimension("lon", fed.shape[2])
+    time = ds.createVariable("time", "f8", ("time",))
+    time.units = "minutes since 1970-01-01 00:00:00"
+    time.standard_name = "time"
+    time.original_step_minutes = int(temporal)
+    time[:] = t_edges[:-1].astype("datetime64[m]").astype(np.int64)
+    lat = ds.createVariable("lat", "f4", ("lat",))
+    lat.units = "degrees_north"
+    lat.standard_name = "latitude"
+    lat[:] = lat_edges[:-1]
+    lon = ds.createVariable("lon", "f4", ("lon",))
+    lon.units = "degrees_east"
+    lon.standard_name = "longitude"
+    lon[:] = lon_edges[:-1]
+    var = ds.createVariable("FED", fed.dtype, ("time", "lat", "lon"), zlib=deflatelevel > 0,
+                            complevel=max(deflatelevel, 1), chunksizes=(1, *fed.shape[1:]))
+    var[:] = fed
+    ds.start_time = str(t_edges[0])
+    ds.end_time = str(t_edges[-1])
+    ds.spatial_resolution = f"{spatial} km"
+    ds.temporal_resolution = f"{temporal} minutes"
+    for k, v in (attrs or {}).items():
+      ds.setncattr(k, v)
+
+
+def read_fed(path):
+  """(fed, time, lat, lon) of a (time, lat, lon) FED cube.
+
+  Reads the NetCDF written by `write_fed` or by grid_fed.jl, and the HDF5 cube
+  of scripts/dataset/coarsen_grids.py; time is datetime64[s] of every frame.
+  """
+  if h5py.is_hdf5(path) and not path.endswith(".nc"):
+    with h5py.File(path, "r") as f:
+      time = f["time"][:].astype("datetime64[s]")
+      return f["FED"][:], time, f["lat"][:], f["lon"][:]
+  with Dataset(path, "r") as ds:
+    var = ds["FED"]
+    dims = var.dimensions
+    fed = np.ma.filled(var[:], 0)
+    t = ds[dims[0]]
+    time = num2date(t[:], t.units, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    lat, lon = ds[dims[1]][:], ds[dims[2]][:]
+  return fed, np.array(time, dtype="datetime64[s]"), np.ma.filled(lat), np.ma.filled(lon)
@@ -0,0 +1,77 @@
+"""Writer for "FED" dataset files laid out for SequenceFED.
+
+SequenceFED reads whole samples along the n axis of the (t, n, 1, w, h) FED
+dataset, so chunks here hold `chunk_samples` complete samples. The mostly-zero
+data compresses well with a fast codec after a byte shuffle. Binary clusters
+can be stored as uint8 ("uint8") or packed 8 cells to a byte along h ("bits",
+with np.packbits); FEDFile unpacks the latter transparently.
+"""
+
+import h5py
+import numpy as np
+
+CODECS = {
+  'lzf': dict(compression='lzf', shuffle=True),
+  'gzip': dict(compression='gzip', compression_opts=1, shuffle=True),
+  'none': {},
+}
+
+STORAGE = ('native', 'uint8', 'bits')
+
+# attribute holding the unpacked h of a bit-packed FED dataset
+BITPACKED_ATTR = 'bitpacked'
+
+
+def encode(block, storage):
+  """Converts a (t, k, 1, w, h) block to the on-disk representation of `storage`."""
+  if storage == 'native':
+    return block
+  if np.any((block != 0) & (block != 1)):
+    raise ValueError(f"storage {storage!r} needs a binary FED (only 0 and 1 values)")
+  block = block.astype(np.uint8)
+  return np.packbits(block, axis=-1) if storage == 'bits' else block
+
+
+def create_fed_dataset(f, shape, dtype, chunk_samples=1, codec='lzf', storage='native', resizable=False):
+  """Creates the FED dataset of a (t, n, 1, w, h) array in an open h5py file."""
+  t, n, c, w, h = shape
+  if storage == 'bits':
+    stored = (t, n, c, w, (h + 7) // 8)
+    dtype = np.uint8
+  else:
+    stored = shape
+    dtype = np.uint8 if storage == 'uint8' else dtype
+  chunks = (t, max(1, min(chunk_samples, n)), c, w, stored[-1])
+  maxshape = (t, None, c, w, stored[-1]) if resizable else None
+  fed = f.create_dataset('FED', stored, dtype=dtype, chunks=chunks, maxshape=maxshape, **CODECS[codec])
+  if storage == 'bits':
+    fed.attrs[BITPACKED_ATTR] = h
+  return fed
+
+
+def decode(raw, h):
+  """Inverse of the 'bits' storage: unpacks the last axis of `raw` back to `h` cells."""
+  return np.unpackbits(raw, axis=-1, count=h)
+
+
+def rechunk(src, dst, chunk_samples=1, codec='lzf', storage='native', block_samples=256):
+  """Rewrites the FED file `src` as `dst` with the given layout, `block_samples` samples at a time.
+
+  The lat/lon/time datasets are copied with the same codec.
+  """
+  with h5py.File(src, 'r') as fin, h5py.File(dst, 'w') as fout:
+    fed_in = fin['FED']
+    if BITPACKED_ATTR in fed_in.attrs:
+      raise ValueError(f"{src} is already bit-packed")
+    fed = create_fed_dataset(fout, fed_in.shape, fed_in.dtype, chunk_samples, codec, storage)
+    n = fed_in.shape[1]
+    # blocks aligned to the output chunks so every chunk is compressed once
+    block = max(chunk_samples, block_samples - block_samples % chunk_samples)
+    for start in range(0, n, block):
+      stop = min(start + block, n)
+      fed[:, start:stop] = encode(fed_in[:, start:stop], storage)
+    for key in fin:
+      if key != 'FED':
+        data = fin[key][:]
+        options = CODECS[codec] if data.ndim > 0 and data.size > 1 else {}
+        fout.create_dataset(key, data=data, **options)
@@ -0,0 +1,61 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher:
+  """Iterates `fn(item)` over `items` on worker threads, in order.
+
+  At most `depth` results are in flight or waiting to be consumed, so host
+  memory stays bounded while the next batches are read, converted and copied
+  to the device during the current training step.
+  """
+
+  def __init__(self, fn, items, depth=2, workers=1):
+    assert depth >= 1 and workers >= 1
+    self.fn = fn
+    self.items = iter(items)
+    self.depth = depth
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    self.pending = deque()
+    self.stats = {'batches': 0, 'starved': 0, 'wait_seconds': 0.0}
+    self._fill()
+
+  def _fill(self):
+    while len(self.pending) < self.depth:
+      try:
+        item = next(self.items)
+      except StopIteration:
+        return
+      self.pending.append(self.executor.submit(self.fn, item))
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if not self.pending:
+      self.close()
+      raise StopIteration
+    future = self.pending.popleft()
+    if not future.done():
+      # the consumer outpaced the workers: training is input-bound here
+      self.stats['starved'] += 1
+      start = time.perf_counter()
+      result = future.result()
+      self.stats['wait_seconds'] += time.perf_counter() - start
+    else:
+      result = future.result()
+    self.stats['batches'] += 1
+    self._fill()
+    return result
+
+  def close(self):
+    for future in self.pending:
+      future.cancel()
+    self.pending.clear()
+    self.executor.shutdown(wait=True)
+
+  def summary(self):
+    s = self.stats
+    return f"batches={s['batches']}, starved={s['starved']}, wait={s['wait_seconds']:.2f}s"
+
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+def sample_activity(dataset, block=256):
+  """Number of active voxels of every sample along n, read `block` samples at a time."""
+  n = dataset.shape[1]
+  activity = np.empty(n, dtype=np.int64)
+  for start in range(0, n, block):
+    stop = min(start + block, n)
+    activity[start:stop] = np.count_nonzero(dataset.read(start, stop), axis=(0,2,3,4))
+  return activity
+
+
+def activity_strata(activity, strata):
+  """Assigns every sample to one of `strata` quantile bins of its activity."""
+  edges = np.quantile(activity, np.linspace(0, 1, strata + 1)[1:-1])
+  return np.searchsorted(edges, activity, side="right")
+
+
+class SequenceSampler:
+  """Splits sample indices into batches, reshuffled every epoch from `seed`.
+
+  When `strata` labels are given, samples are shuffled within each stratum and
+  spread evenly over the epoch, so every batch holds roughly the same mix of
+  quiet and active storms.
+  """
+
+  def __init__(self, indices, batchsize, shuffle=True, seed=42, strata=None, drop_last=False):
+    self.indices = np.asarray(indices, dtype=np.int64)
+    self.batchsize = batchsize
+    self.shuffle = shuffle
+    self.seed = seed
+    self.strata = None if strata is None else np.asarray(strata)
+    self.drop_last = drop_last
+
+  def __len__(self):
+    n = len(self.indices)
+    return n // self.batchsize if self.drop_last else -(-n // self.batchsize)
+
+  def order(self, epoch):
+    if not self.shuffle:
+      return self.indices
+    rng = np.random.default_rng((self.seed, epoch))
+    if self.strata is None:
+      return rng.permutation(self.indices)
+    # position of each sample inside its own shuffled stratum, scaled to [0, 1)
+    position = np.empty(len(self.indices))
+    for s in np.unique(self.strata):
+      members = np.flatnonzero(self.strata == s)
+      position[members] = (rng.permutation(len(members)) + rng.random(len(members))) / len(members)
+    return self.indices[np.argsort(position, kind="stable")]
+
+  def batches(self, epoch=0):
+    """Returns the index array of every batch of `epoch`."""
+    order = self.order(epoch)
+    return [order[t:t+self.batchsize] for t in range(0, len(self) * self.batchsize, self.batchsize)]
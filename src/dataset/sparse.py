@@ -0,0 +1,119 @@
+"""Sparse (CSR) storage of FED windows.
+
+Each sample is stored as the flat (t, w, h) indices of its active voxels:
+`indptr` (n+1,) delimits the voxels of every sample inside `indices` (nnz,),
+and `values` (nnz,) holds their values unless the windows are binary. The
+same arrays are the on-disk datasets and the in-memory representation,
+except that on disk `indices` holds the differences between consecutive
+indices, which are mostly small and compress several times better. Batches
+are densified straight into the (t, k, w, h, 1) layout SequenceFED returns,
+with a single scatter.
+"""
+
+import h5py
+import numpy as np
+
+# attribute marking a sparse file, holding the dense (t, n, w, h) shape
+SPARSE_ATTR = 'sparse_shape'
+
+
+def to_csr(block):
+  """(counts, indices, values) of a dense (t, k, 1, w, h) block, sample by sample."""
+  t, k = block.shape[:2]
+  rows, cols = np.nonzero(block.transpose(1, 0, 2, 3, 4).reshape(k, -1))
+  values = block.transpose(1, 0, 2, 3, 4).reshape(k, -1)[rows, cols]
+  return np.bincount(rows, minlength=k), cols.astype(np.uint32), values
+
+
+def write_sparse(src, dst, block_samples=1024, compression='gzip'):
+  """Converts the dense FED file `src` into a sparse file `dst`.
+
+  Values are only stored when the windows are not binary. The lat/lon/time
+  datasets are copied as they are.
+  """
+  with h5py.File(src, 'r') as fin, h5py.File(dst, 'w') as fout:
+    fed = fin['FED']
+    t, n, _, w, h = fed.shape
+    counts, indices, values = [], [], []
+    for start in range(0, n, block_samples):
+      c, i, v = to_csr(fed[:, start:start+block_samples])
+      counts.append(c)
+      indices.append(i)
+      values.append(v)
+    indices, values = np.concatenate(indices), np.concatenate(values)
+    indptr = np.concatenate([[0], np.cumsum(np.concatenate(counts))]).astype(np.int64)
+    fout.attrs[SPARSE_ATTR] = (t, n, w, h)
+    fout.attrs['dtype'] = fed.dtype.str
+    fout.create_dataset('indptr', data=indptr)
+    deltas = np.diff(indices.astype(np.int64), prepend=0).astype(np.int32)
+    fout.create_dataset('indices', data=deltas, compression=compression, shuffle=True)
+    if not np.all(values == 1):
+      fout.create_dataset('values', data=values, compression=compression, shuffle=True)
+    for key in fin:
+      if key != 'FED':
+        fout.create_dataset(key, data=fin[key][:])
+
+
+def is_sparse(path):
+  with h5py.File(path, 'r') as f:
+    return SPARSE_ATTR in f.attrs
+
+
+def densify(indptr, indices, values, samples, shape, dtype, out=None):
+  """Dense (t, k, w, h, 1) batch of the CSR `samples`, with one scatter into `out`."""
+  t, w, h = shape
+  frame = w * h
+  samples = np.asarray(samples, dtype=np.int64)
+  k = len(samples)
+  if out is None:
+    out = np.zeros((t, k, w, h, 1), dtype=dtype)
+  else:
+    out[...] = 0
+  starts, stops = indptr[samples], indptr[samples + 1]
+  lengths = stops - starts
+  # positions in `indices` of every voxel of the batch, sample after sample
+  offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+  positions = np.arange(offsets.size) + offsets
+  voxel = indices[positions].astype(np.int64)
+  row = np.repeat(np.arange(k), lengths)
+  target = (voxel // frame) * (k * frame) + row * frame + voxel % frame
+  out.reshape(-1)[target] = 1 if values is None else values[positions]
+  return out
+
+
+class SparseFEDFile:
+  """In-memory CSR FED windows of a sparse file, with the interface of FEDFile."""
+
+  def __init__(self, path):
+    self.path = path
+    with h5py.File(path, 'r') as f:
+      t, n, w, h = (int(x) for x in f.attrs[SPARSE_ATTR])
+      self.dtype = np.dtype(f.attrs['dtype'])
+      self.indptr = f['indptr'][:]
+      self.indices = np.cumsum(f['indices'][:], dtype=np.int64).astype(np.uint32)
+      self.values = f['values'][:] if 'values' in f else None
+    self.shape = (t, n, w, h, 1)
+    self.chunk_samples = 1
+
+  def __len__(self):
+    return self.shape[1]
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      idx = np.arange(*idx.indices(len(self)))
+    return self.take(idx)
+
+  @property
+  def nbytes(self):
+    return self.indptr.nbytes + self.indices.nbytes + (0 if self.values is None else self.values.nbytes)
+
+  def read(self, start, stop, out=None):
+    return self.take(np.arange(start, stop), out)
+
+  def take(self, indices, out=None):
+    t, _, w, h, _ = self.shape
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    return densify(self.indptr, self.indices, self.values, indices, (t, w, h), self.dtype, out)
+
+  def close(self):
+    pass
@@ -0,0 +1,45 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+
+THRESHOLDS = np.round(np.arange(0.05, 0.96, 0.05), 2).astype(np.float32)
+
+
+def contingency_counts(y_pred, y, thresholds=THRESHOLDS):
+  """Counts TP, FN, FP and TN of `y_pred > t` against `y`, per lead time and threshold.
+
+  `y_pred` and `y` have the lead time as their first axis. Every voxel is
+  binned once by how many thresholds it exceeds and the counts of all
+  thresholds follow from a cumulative sum, so the cost does not grow with the
+  number of thresholds. Returns (lead times, thresholds) arrays.
+  """
+  T = y_pred.shape[0]
+  K = len(thresholds)
+  y_pred = y_pred.reshape(T, -1)
+  y = y.reshape(T, -1).astype(jnp.float32)
+  # number of thresholds strictly below each prediction
+  bins = jnp.searchsorted(jnp.asarray(thresholds, dtype=y_pred.dtype), y_pred, side='left')
+  segments = (jnp.arange(T)[:, None] * (K + 1) + bins).reshape(-1)
+  positives = jax.ops.segment_sum(y.reshape(-1), segments, num_segments=T*(K+1)).reshape(T, K+1)
+  negatives = jax.ops.segment_sum((1 - y).reshape(-1), segments, num_segments=T*(K+1)).reshape(T, K+1)
+  # y_pred > thresholds[k] for every voxel in bins k+1..K
+  above = lambda counts: jnp.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+  tp, fp = above(positives), above(negatives)
+  return {
+    'TP': tp,
+    'FN': positives.sum(axis=1, keepdims=True) - tp,
+    'FP': fp,
+    'TN': negatives.sum(axis=1, keepdims=True) - fp,
+  }
+
+
+def scores(counts):
+  """CSI, POD and FAR curves from accumulated contingency counts."""
+  tp, fn, fp = (np.asarray(counts[k], dtype=np.float64) for k in ('TP', 'FN', 'FP'))
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return {
+      'csi': tp / (tp + fn + fp),
+      'pod': tp / (tp + fn),
+      'far': fp / (tp + fp),
+    }
@@ -11,13 +11,24 @@
 
 # adapted from https://github.com/jhhuang96/ConvLSTM-PyTorch
 
+from collections import OrderedDict
+from typing import Optional, Tuple
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class CLSTM_cell(nn.Module):
   """ConvLSTMCell
+
+  The hidden state is allocated on the device and dtype of the inputs, so the
+  same cell runs on CPU and GPU. Call `to_channels_last` to run the convolutions
+  in NHWC memory format (usually faster on CPU), and see `compile_cell` for
+  TorchScript / torch.compile.
   """
+  channels_last: bool
+
   def __init__(self, shape, input_channels, filter_size, num_features):
     super(CLSTM_cell, self).__init__()
 
@@ -27,40 +38,149 @@ def __init__(self, shape, input_channels, filter_size, num_features):
     self.num_features = num_features
     # in this way the output has the same size
     self.padding = (filter_size - 1) // 2
+    self.channels_last = False
     self.conv = nn.Sequential(
       nn.Conv2d(self.input_channels + self.num_features,
             4 * self.num_features, self.filter_size, 1,
             self.padding),
       nn.GroupNorm(4 * self.num_features // 32, 4 * self.num_features))
 
-  def forward(self, inputs, hidden_state=None):
+  def to_channels_last(self):
+    self.channels_last = True
+    return self.to(memory_format=torch.channels_last)
+
+  def forward(self, inputs, hidden_state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None):
     #  seq_len=10 for moving_mnist
+    seq_len, batch = inputs.size(0), inputs.size(1)
     if hidden_state is None:
-      hx = torch.zeros(inputs.size(1), self.num_features, self.shape[0],
-               self.shape[1]).cuda()
-      cx = torch.zeros(inputs.size(1), self.num_features, self.shape[0],
-               self.shape[1]).cuda()
+      hx = inputs.new_zeros(batch, self.num_features, self.shape[0], self.shape[1])
+      cx = inputs.new_zeros(batch, self.num_features, self.shape[0], self.shape[1])
     else:
       hx, cx = hidden_state
-    output_inner = []
-    for index in range(inputs.size(0)):
-      x = inputs[index, ...]
-      combined = torch.cat((x, hx), 1)
-      gates = self.conv(combined)  # gates: S, num_features*4, H, W
-      # it should return 4 tensors: i,f,g,o
-      ingate, forgetgate, cellgate, outgate = torch.split(
-        gates, self.num_features, dim=1)
-      ingate = torch.sigmoid(ingate)
-      forgetgate = torch.sigmoid(forgetgate)
-      cellgate = torch.tanh(cellgate)
-      outgate = torch.sigmoid(outgate)
-
-      cy = (forgetgate * cx) + (ingate * cellgate)
-      hy = outgate * torch.tanh(cy)
-      output_inner.append(hy)
+    memory_format = torch.channels_last if self.channels_last else torch.contiguous_format
+    conv = self.conv[0]
+    norm = self.conv[1]
+    # conv(cat(x, h)) == conv_x(x) + conv_h(h): the input half doesn't depend on
+    # the recurrence, so it runs once over the whole sequence
+    weight_x = conv.weight[:, :self.input_channels].contiguous(memory_format=memory_format)
+    weight_h = conv.weight[:, self.input_channels:].contiguous(memory_format=memory_format)
+    frames = inputs.reshape(seq_len * batch, inputs.size(2), inputs.size(3), inputs.size(4))
+    gates_x = F.conv2d(frames.contiguous(memory_format=memory_format),
+                       weight_x, conv.bias, 1, self.padding)
+    gates_x = gates_x.view(seq_len, batch, gates_x.size(1), gates_x.size(2), gates_x.size(3))
+    output = inputs.new_empty(seq_len, batch, self.num_features, gates_x.size(3), gates_x.size(4))
+    # without autograd, the gates are updated in place and cy lives in one buffer
+    fused = not torch.is_grad_enabled()
+    if fused:
+      cx = cx.clone(memory_format=torch.contiguous_format)
+    buffer = torch.empty_like(cx)
+    hy, cy = hx, cx
+    for index in range(seq_len):
+      if index == 0 and hidden_state is None:
+        # conv_h of the zero initial state is zero
+        gates = norm(gates_x[index])
+      else:
+        gates = norm(F.conv2d(hx, weight_h, None, 1, self.padding).add_(gates_x[index]))
+      if fused:
+        hy, cy = fused_gate_update(gates, cx, output[index], buffer, self.num_features)
+      else:
+        hy, cy = gate_update(gates, cx, self.num_features)
+        output[index] = hy
       hx = hy
       cx = cy
-    return torch.stack(output_inner), (hy, cy)
+    return output, (hy, cy)
+
+  @torch.jit.export
+  def step(self, frame, hidden_state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None):
+    """Advances the cell by a single (B, C, H, W) frame.
+
+    Returns the output for that frame and the new (hx, cx), to be passed back
+    with the next frame, so each call costs one timestep whatever the history.
+    """
+    output, state = self.forward(frame.unsqueeze(0), hidden_state)
+    return output[0], state
+
+
+def gate_update(gates, cx, num_features: int):
+  """LSTM update from the stacked (i, f, g, o) gates, allocating new tensors."""
+  # it should return 4 tensors: i,f,g,o
+  ingate, forgetgate, cellgate, outgate = torch.split(gates, num_features, dim=1)
+  ingate = torch.sigmoid(ingate)
+  forgetgate = torch.sigmoid(forgetgate)
+  cellgate = torch.tanh(cellgate)
+  outgate = torch.sigmoid(outgate)
+
+  cy = (forgetgate * cx) + (ingate * cellgate)
+  hy = outgate * torch.tanh(cy)
+  return hy, cy
+
+
+def fused_gate_update(gates, cx, hy, buffer, num_features: int):
+  """Same as `gate_update`, but without temporaries (not differentiable).
+
+  The activations are applied in place on `gates`, `cx` is overwritten with the
+  new cell state and `hy` (e.g. a slice of the output) receives the new hidden
+  state; `buffer` is scratch space shaped like `cx`.
+  """
+  gates[:, :2 * num_features].sigmoid_()
+  gates[:, 2 * num_features:3 * num_features].tanh_()
+  gates[:, 3 * num_features:].sigmoid_()
+  ingate, forgetgate, cellgate, outgate = torch.split(gates, num_features, dim=1)
+  cy = cx.mul_(forgetgate).addcmul_(ingate, cellgate)
+  torch.tanh(cy, out=buffer)
+  torch.mul(outgate, buffer, out=hy)
+  return hy, cy
+
+
+class CLSTMSession:
+  """Carries the (hx, cx) of a CLSTM_cell between calls for many tracked regions.
+
+  Each call to `push` advances every given region by one new frame, batching
+  them through the cell together. At most `max_regions` states are kept; the
+  least recently updated regions are dropped first.
+  """
+
+  def __init__(self, cell, max_regions=1024):
+    self.cell = cell
+    self.max_regions = max_regions
+    self.states = OrderedDict()
+
+  def __len__(self):
+    return len(self.states)
+
+  def __contains__(self, region):
+    return region in self.states
+
+  def push(self, frames):
+    """Takes {region: (C, H, W) frame} and returns {region: (F, H, W) output}."""
+    regions = list(frames)
+    batch = torch.stack([frames[r] for r in regions])
+    hidden_state = None
+    if any(r in self.states for r in regions):
+      zeros = batch.new_zeros(self.cell.num_features, *self.cell.shape)
+      hx = torch.stack([self.states[r][0] if r in self.states else zeros for r in regions])
+      cx = torch.stack([self.states[r][1] if r in self.states else zeros for r in regions])
+      hidden_state = (hx, cx)
+    with torch.inference_mode():
+      output, (hy, cy) = self.cell.step(batch, hidden_state)
+    for i, r in enumerate(regions):
+      self.states[r] = (hy[i], cy[i])
+      self.states.move_to_end(r)
+    while len(self.states) > self.max_regions:
+      self.states.popitem(last=False)
+    return {r: output[i] for i, r in enumerate(regions)}
 
+  def drop(self, region):
+    """Forgets a region, e.g. once its storm has dissipated."""
+    self.states.pop(region, None)
 
 
+def compile_cell(cell, mode=None):
+  """Returns `cell` as is (None), scripted ("script") or wrapped by torch.compile ("compile")."""
+  if mode is None:
+    return cell
+  if mode == "script":
+    return torch.jit.script(cell)
+  if mode == "compile":
+    return torch.compile(cell)
+  raise ValueError(f"unknown compile mode {mode}")
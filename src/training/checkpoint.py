@@ -0,0 +1,102 @@
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jax
+import numpy as np
+from flax.training import checkpoints
+
+
+class AsyncCheckpointer:
+  """Writes Flax checkpoints on a background thread while training continues.
+
+  `save` copies the state to host memory and returns; the write happens on a
+  single worker thread, waiting only if the previous write is still running.
+  Afterwards only the last `keep` checkpoints and the `keep_best` ones with the
+  best `metric` (lowest, or highest when `mode="max"`) stay on disk.
+
+  The history is rebuilt from the checkpoints found in `ckpt_dir`, with the
+  metrics of checkpoints.json where they are listed. Steps are never
+  overwritten: saving a step that is not past the newest one on disk raises.
+  """
+
+  HISTORY_FILENAME = "checkpoints.json"
+
+  def __init__(self, ckpt_dir, keep=3, keep_best=1, metric="loss", mode="min", prefix="checkpoint_"):
+    assert mode in ("min", "max")
+    self.ckpt_dir = ckpt_dir
+    self.keep = keep
+    self.keep_best = keep_best
+    self.metric = metric
+    self.mode = mode
+    self.prefix = prefix
+    self.executor = ThreadPoolExecutor(max_workers=1)
+    self.future = None
+    self.latencies = []
+    os.makedirs(ckpt_dir, exist_ok=True)
+    history_path = os.path.join(ckpt_dir, self.HISTORY_FILENAME)
+    saved = {}
+    if os.path.exists(history_path):
+      with open(history_path) as f:
+        saved = {int(k): v for k, v in json.load(f).items()}
+    self.history = {step: saved.get(step, {}) for step in self.steps_on_disk()}
+
+  def steps_on_disk(self):
+    pattern = re.compile(re.escape(self.prefix) + r"(\d+)$")
+    matches = (pattern.match(name) for name in os.listdir(self.ckpt_dir))
+    return sorted(int(m.group(1)) for m in matches if m)
+
+  def save(self, state, step, metrics=None):
+    self.wait()
+    if self.history and int(step) <= max(self.history):
+      raise ValueError(f"{self.ckpt_dir} already holds checkpoints up to step {max(self.history)}; "
+                       f"remove them or use another directory to save step {step}")
+    host_state = jax.device_get(state)
+    metrics = {k: float(np.mean(v)) for k, v in jax.device_get(metrics or {}).items()}
+    self.future = self.executor.submit(self._write, host_state, step, metrics)
+
+  def _write(self, host_state, step, metrics):
+    start = time.perf_counter()
+    checkpoints.save_checkpoint(self.ckpt_dir, target=host_state, step=step,
+                                prefix=self.prefix, keep=2**31)
+    self.history[int(step)] = metrics
+    self._apply_retention(keep=int(step))
+    with open(os.path.join(self.ckpt_dir, self.HISTORY_FILENAME), "w") as f:
+      json.dump(self.history, f)
+    self.latencies.append(time.perf_counter() - start)
+
+  def retained_steps(self):
+    steps = sorted(self.history)
+    kept = set(steps[-self.keep:]) if self.keep > 0 else set()
+    scored = [s for s in steps if self.metric in self.history[s]]
+    scored.sort(key=lambda s: self.history[s][self.metric], reverse=self.mode == "max")
+    kept.update(scored[:self.keep_best])
+    return kept
+
+  def _apply_retention(self, keep=None):
+    kept = self.retained_steps() | {keep}
+    for step in [s for s in self.history if s not in kept]:
+      path = os.path.join(self.ckpt_dir, f"{self.prefix}{step}")
+      if os.path.isdir(path):
+        shutil.rmtree(path)
+      elif os.path.exists(path):
+        os.remove(path)
+      del self.history[step]
+
+  def wait(self):
+    """Blocks until the pending write (if any) is on disk, re-raising its errors."""
+    if self.future is not None:
+      self.future.result()
+      self.future = None
+
+  def close(self):
+    self.wait()
+    self.executor.shutdown()
+
+  def summary(self):
+    if not self.latencies:
+      return "no checkpoints written"
+    return f"writes={len(self.latencies)}, last={self.latencies[-1]:.2f}s, max={max(self.latencies):.2f}s"
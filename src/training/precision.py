@@ -0,0 +1,35 @@
+import dataclasses
+from typing import Any
+
+import jax
+import jax.numpy as jnp
+
+
+@dataclasses.dataclass(frozen=True)
+class Policy:
+  """Dtypes used for the stored parameters, the model computation and its output.
+
+  Parameters (and so gradients and optimizer state) stay in `param_dtype`; a
+  copy cast to `compute_dtype` is what the model sees, and its predictions are
+  cast back to `output_dtype` before the loss.
+  """
+  param_dtype: Any = jnp.float32
+  compute_dtype: Any = jnp.float32
+  output_dtype: Any = jnp.float32
+
+  def cast_to_compute(self, tree):
+    return _cast_floating(tree, self.compute_dtype)
+
+  def cast_to_output(self, tree):
+    return _cast_floating(tree, self.output_dtype)
+
+
+def _cast_floating(tree, dtype):
+  return jax.tree_util.tree_map(
+    lambda x: x.astype(dtype) if jnp.issubdtype(x.dtype, jnp.floating) else x, tree)
+
+
+POLICIES = {
+  'fp32': Policy(),
+  'bf16': Policy(compute_dtype=jnp.bfloat16),
+}
@@ -0,0 +1,37 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class EpochTimer:
+  """Accumulates wall-clock seconds spent in named phases of an epoch."""
+
+  def __init__(self):
+    self.totals = defaultdict(float)
+
+  @contextmanager
+  def phase(self, name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.totals[name] += time.perf_counter() - start
+
+  def iterate(self, name, iterable):
+    """Yields from `iterable`, charging the time spent in `next` to `name`."""
+    it = iter(iterable)
+    while True:
+      with self.phase(name):
+        try:
+          item = next(it)
+        except StopIteration:
+          return
+      yield item
+
+  def reset(self):
+    totals = dict(self.totals)
+    self.totals.clear()
+    return totals
+
+  def summary(self):
+    return ", ".join(f"{k}={v:.2f}s" for k, v in self.totals.items())